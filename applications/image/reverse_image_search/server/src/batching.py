@@ -0,0 +1,62 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from logs import LOGGER
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent calls into batches.
+
+    Items submitted from several threads are collected for up to `max_wait` seconds or
+    `max_size` items, grouped by key, and passed to `func(key, items)` in one call, which
+    must return one result per item. Every caller gets its own result through a future.
+    """
+    def __init__(self, func, max_size, max_wait, workers=1, name='batcher'):
+        self.func = func
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        for i in range(workers):
+            threading.Thread(target=self._loop, name=f"{name}-{i}", daemon=True).start()
+
+    def submit(self, item, key=None):
+        future = Future()
+        self.queue.put((key, item, future))
+        return future
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            groups = {}
+            for key, item, future in self._collect():
+                groups.setdefault(key, []).append((item, future))
+            for key, entries in groups.items():
+                self._run(key, entries)
+
+    def _run(self, key, entries):
+        try:
+            results = list(self.func(key, [item for item, _ in entries]))
+            if len(results) != len(entries):
+                raise ValueError(f"Got {len(results)} results for {len(entries)} items")
+            for (_, future), result in zip(entries, results):
+                future.set_result(result)
+        except (Exception, SystemExit) as e:
+            # The helpers call sys.exit on errors, which must not stop the batcher
+            LOGGER.error(f"Error with batch of {len(entries)} items: {e!r}")
+            for _, future in entries:
+                if not future.done():
+                    future.set_exception(e)
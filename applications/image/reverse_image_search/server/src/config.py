@@ -8,6 +8,34 @@
 METRIC_TYPE = os.getenv("METRIC_TYPE", "L2")
 DEFAULT_TABLE = os.getenv("DEFAULT_TABLE", "milvus_img_search")
 TOP_K = int(os.getenv("TOP_K", "10"))
+# Collections loaded into memory at startup, comma separated, "*" for all of them and "" for none
+PRELOAD_COLLECTIONS = os.getenv("PRELOAD_COLLECTIONS", "*")
+# Seconds a collection count may be served from cache
+COUNT_MAX_STALENESS = float(os.getenv("COUNT_MAX_STALENESS", "5"))
+# Where search gets the image paths from: "mysql", or "milvus" to keep them in a VARCHAR field of new
+# collections and return them with the search results, MySQL is then only a mirror for listing and deleting
+STORAGE_MODE = os.getenv("STORAGE_MODE", "mysql")
+PATH_MAX_LENGTH = int(os.getenv("PATH_MAX_LENGTH", "1024"))
+# Ids per delete request, and the ratio of deleted rows that triggers the compaction of a collection
+DELETE_BATCH_SIZE = int(os.getenv("DELETE_BATCH_SIZE", "1000"))
+COMPACT_DELETED_RATIO = float(os.getenv("COMPACT_DELETED_RATIO", "0.2"))
+# Index of the collections: FLAT, IVF_FLAT, IVF_SQ8, IVF_PQ, HNSW, DISKANN, or AUTO to choose it from the
+# number of rows. TABLE_INDEX_TYPES overrides it per table, e.g. "small_dept:FLAT,big_dept:IVF_PQ"
+INDEX_TYPE = os.getenv("INDEX_TYPE", "AUTO")
+TABLE_INDEX_TYPES = os.getenv("TABLE_INDEX_TYPES", "")
+# AUTO uses FLAT below AUTO_FLAT_MAX_ROWS rows, HNSW below AUTO_HNSW_MAX_ROWS, IVF_SQ8 below AUTO_IVF_MAX_ROWS
+# and DISKANN above
+AUTO_FLAT_MAX_ROWS = int(os.getenv("AUTO_FLAT_MAX_ROWS", "10000"))
+AUTO_HNSW_MAX_ROWS = int(os.getenv("AUTO_HNSW_MAX_ROWS", "1000000"))
+AUTO_IVF_MAX_ROWS = int(os.getenv("AUTO_IVF_MAX_ROWS", "10000000"))
+# Index build and search params, IVF_NLIST 0 derives nlist from the number of rows
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+PQ_M = int(os.getenv("PQ_M", "64"))
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF = int(os.getenv("HNSW_EF", "64"))
+DISKANN_SEARCH_LIST = int(os.getenv("DISKANN_SEARCH_LIST", "100"))
 
 ############### MySQL Configuration ###############
 MYSQL_HOST = os.getenv("MYSQL_HOST", "127.0.0.1")
@@ -15,9 +43,57 @@
 MYSQL_USER = os.getenv("MYSQL_USER", "root")
 MYSQL_PWD = os.getenv("MYSQL_PWD", "194044")
 MYSQL_DB = os.getenv("MYSQL_DB", "image_search")
+MYSQL_POOL_SIZE = int(os.getenv("MYSQL_POOL_SIZE", "8"))
+# Seconds a pooled connection may stay idle before it is pinged on borrow
+MYSQL_PING_INTERVAL = float(os.getenv("MYSQL_PING_INTERVAL", "30"))
+
+############### Load Configuration ###############
+LOAD_BATCH_SIZE = int(os.getenv("LOAD_BATCH_SIZE", "32"))
+LOAD_WORKERS = int(os.getenv("LOAD_WORKERS", str(os.cpu_count() or 4)))
+LOAD_FLUSH_SIZE = int(os.getenv("LOAD_FLUSH_SIZE", "1024"))
+LOAD_JOB_WORKERS = int(os.getenv("LOAD_JOB_WORKERS", "4"))
+JOB_TTL = int(os.getenv("JOB_TTL", "86400"))
+# Dedup on ingest: "off", "exact" to skip copies with the same content, or "near" to also skip images
+# whose perceptual hash is within DEDUP_MAX_DISTANCE bits of an image of the table
+DEDUP_MODE = os.getenv("DEDUP_MODE", "off")
+DEDUP_MAX_DISTANCE = int(os.getenv("DEDUP_MAX_DISTANCE", "4"))
+
+############### Request Configuration ###############
+# Threads serving the blocking work of the API handlers
+REQUEST_WORKERS = int(os.getenv("REQUEST_WORKERS", "32"))
+# Concurrent forward passes for query images
+MODEL_WORKERS = int(os.getenv("MODEL_WORKERS", "2"))
+# Concurrent query images and vectors are coalesced into batches of up to BATCH_MAX_SIZE items,
+# waiting at most BATCH_MAX_WAIT_MS for the batch to fill
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", "4"))
+# Max number of query vectors sent in one Milvus search by a batch search
+BATCH_SEARCH_SIZE = int(os.getenv("BATCH_SEARCH_SIZE", "1024"))
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "16"))
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", "30"))
+
+############### Search Cache Configuration ###############
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "4096"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "600"))
 
 ############### Data Path ###############
 UPLOAD_PATH = os.getenv("UPLOAD_PATH", "tmp/search-images")
+MANIFEST_PATH = os.getenv("MANIFEST_PATH", "tmp/manifest")
+DEDUP_PATH = os.getenv("DEDUP_PATH", "tmp/dedup")
+THUMBNAIL_PATH = os.getenv("THUMBNAIL_PATH", "tmp/thumbnails")
+
+############### Image Serving Configuration ###############
+# Thumbnail presets of /data as name:max side in pixels, the least recently used thumbnails are evicted
+# once the cache exceeds THUMBNAIL_CACHE_SIZE bytes
+THUMBNAIL_SIZES = os.getenv("THUMBNAIL_SIZES", "small:128,medium:320,large:640")
+THUMBNAIL_CACHE_SIZE = int(os.getenv("THUMBNAIL_CACHE_SIZE", str(1024 ** 3)))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "85"))
+# Seconds browsers may reuse an image before revalidating it with its ETag
+IMAGE_CACHE_MAX_AGE = int(os.getenv("IMAGE_CACHE_MAX_AGE", "86400"))
 
 ############### Number of log files ###############
 LOGS_NUM = int(os.getenv("logs_num", "0"))
+# Min seconds between two records of the same throttled log, such as the per batch progress of a load
+LOG_THROTTLE_SECONDS = float(os.getenv("LOG_THROTTLE_SECONDS", "1"))
@@ -0,0 +1,139 @@
+import io
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from diskcache import Cache
+from config import DEDUP_MODE, DEDUP_MAX_DISTANCE, DEDUP_PATH, LOAD_WORKERS
+from logs import LOGGER
+
+HASH_BITS = 64
+
+
+class DedupIndex:
+    """
+    Index of the content hash and the perceptual hash of the images of every table.
+
+    Exact copies are found by the hash of the file content, near copies by a 64 bit difference hash
+    within max_distance bits. The difference hash is split into max_distance + 1 bands, and two hashes
+    within max_distance bits share at least one band, so only the images sharing a band are compared.
+    """
+    def __init__(self, cache_path=DEDUP_PATH, mode=DEDUP_MODE, max_distance=DEDUP_MAX_DISTANCE):
+        self.cache = Cache(cache_path, tag_index=True)
+        self.mode = mode
+        self.max_distance = max_distance
+        num_bands = max_distance + 1
+        width = HASH_BITS // num_bands
+        self.bands = [(i * width, HASH_BITS - i * width if i == num_bands - 1 else width) for i in range(num_bands)]
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=LOAD_WORKERS, thread_name_prefix='dedup')
+
+    @property
+    def enabled(self):
+        return self.mode in ('exact', 'near')
+
+    @staticmethod
+    def perceptual_hash(img):
+        # Difference hash: the signs of the horizontal gradients of the 9x8 grayscale thumbnail
+        pixels = np.asarray(img.convert('L').resize((9, 8), Image.LANCZOS), dtype=np.int16)
+        bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+        return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+    def hashes(self, img_path, content=None):
+        # Get the (content hash, perceptual hash) of the image, or of its content not saved yet, None if it can not be read
+        try:
+            if content is None:
+                with open(img_path, 'rb') as f:
+                    content = f.read()
+            phash = None
+            if self.mode == 'near':
+                with Image.open(io.BytesIO(content)) as img:
+                    phash = self.perceptual_hash(img)
+            return hashlib.blake2b(content, digest_size=16).hexdigest(), phash
+        except Exception as e:
+            LOGGER.error(f"Error with hashing image {img_path}: {e}")
+            return None
+
+    def band_keys(self, table_name, phash):
+        return [f"{table_name}:band{i}:{(phash >> start) & ((1 << width) - 1)}"
+                for i, (start, width) in enumerate(self.bands)]
+
+    def _find(self, get, table_name, hashes, exclude=None):
+        # Get the milvus id of an exact or near copy from the get(key) store other than exclude, None if there is none
+        sha, phash = hashes
+        milvus_id = get(f"{table_name}:sha:{sha}")
+        if milvus_id is not None and milvus_id != exclude:
+            return milvus_id
+        if phash is None:
+            return None
+        for key in self.band_keys(table_name, phash):
+            for other, milvus_id in get(key) or []:
+                if milvus_id != exclude and bin(other ^ phash).count('1') <= self.max_distance:
+                    return milvus_id
+        return None
+
+    def _add(self, get, put, table_name, hashes, milvus_id):
+        sha, phash = hashes
+        put(f"{table_name}:sha:{sha}", milvus_id)
+        if phash is not None:
+            for key in self.band_keys(table_name, phash):
+                put(key, (get(key) or []) + [(phash, milvus_id)])
+
+    def find(self, table_name, hashes, exclude=None):
+        return self._find(self.cache.get, table_name, hashes, exclude)
+
+    def filter(self, table_name, img_paths, previous_ids=None, contents=None):
+        # Split the images into the ones to insert, and the copies of images of the table or of earlier
+        # images of the list. Return the images to insert and the hashes of every image that could be read.
+        # previous_ids maps a modified image to the milvus id of its earlier version, which it may match.
+        # contents maps the images not saved yet to their content.
+        previous_ids = previous_ids or {}
+        contents = contents or {}
+        hashes = dict(zip(img_paths, self.pool.map(lambda path: self.hashes(path, contents.get(path)), img_paths)))
+        batch = {}
+        kept = []
+        for img_path in img_paths:
+            entry = hashes[img_path]
+            if entry is not None:
+                if self.find(table_name, entry, previous_ids.get(img_path)) is not None or self._find(batch.get, table_name, entry) is not None:
+                    continue
+                self._add(batch.get, batch.__setitem__, table_name, entry, img_path)
+            kept.append(img_path)
+        if len(kept) < len(img_paths):
+            LOGGER.info(f"Skip {len(img_paths) - len(kept)} duplicate images of table {table_name}")
+        return kept, {path: entry for path, entry in hashes.items() if entry is not None}
+
+    def add(self, table_name, hashes, ids):
+        # Record the hashes of the images inserted with the milvus ids
+        with self.lock, self.cache.transact():
+            put = lambda key, value: self.cache.set(key, value, tag=table_name)
+            for entry, milvus_id in zip(hashes, ids):
+                if entry is None:
+                    continue
+                milvus_id = int(milvus_id)
+                self._add(self.cache.get, put, table_name, entry, milvus_id)
+                put(f"{table_name}:id:{milvus_id}", entry)
+
+    def discard(self, table_name, ids):
+        # Forget the hashes of deleted milvus ids
+        with self.lock, self.cache.transact():
+            for milvus_id in map(int, ids):
+                entry = self.cache.pop(f"{table_name}:id:{milvus_id}")
+                if entry is None:
+                    continue
+                sha, phash = entry
+                if self.cache.get(f"{table_name}:sha:{sha}") == milvus_id:
+                    self.cache.delete(f"{table_name}:sha:{sha}")
+                if phash is not None:
+                    for key in self.band_keys(table_name, phash):
+                        entries = [e for e in self.cache.get(key) or [] if e[1] != milvus_id]
+                        self.cache.set(key, entries, tag=table_name)
+
+    def clear_table(self, table_name):
+        num = self.cache.evict(table_name)
+        LOGGER.debug(f"Clear {num} dedup entries of table {table_name}")
+        return num
+
+
+DEDUP = DedupIndex()
@@ -1,19 +1,91 @@
-from towhee import pipe, ops
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from towhee import ops
+from towhee.types import Image
+from config import LOAD_BATCH_SIZE, LOAD_WORKERS, MODEL_WORKERS, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS
+from batching import MicroBatcher
+from logs import LOGGER
 
 
 class Resnet50:
     def __init__(self):
-        self.image_embedding_pipe = (
-            pipe.input('path')
-                .map('path', 'img', ops.image_decode.cv2_rgb())
-                .map('img', 'embedding', ops.image_embedding.timm(model_name='resnet50'))
-                .map('embedding', 'embedding', ops.towhee.np_normalize())
-                .output('embedding')
-            )
-
-    def resnet50_extract_feat(self, img_path):
-        feat = self.image_embedding_pipe(img_path)
-        return feat.get()[0]
+        # Use the towhee operators directly so that the decode stage can run on a worker pool
+        # and the timm ResNet50 can take a stacked batch of images in one forward pass
+        self.image_decode = ops.image_decode.cv2_rgb().get_op()
+        self.image_embedding = ops.image_embedding.timm(model_name='resnet50').get_op()
+        self.decode_pool = ThreadPoolExecutor(max_workers=LOAD_WORKERS, thread_name_prefix='decode')
+        # Query images of concurrent requests are embedded together in one forward pass,
+        # with at most MODEL_WORKERS forward passes running at the same time
+        self.query_batcher = MicroBatcher(lambda _, imgs: self.embed(imgs), BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS / 1000,
+                                          workers=MODEL_WORKERS, name='embed')
+
+    @staticmethod
+    def normalize(feat):
+        feat = np.asarray(feat, dtype=np.float32)
+        return feat / np.linalg.norm(feat)
+
+    def decode(self, img):
+        # Decode a path or url with the towhee operator, and raw bytes or an RGB ndarray in memory
+        if isinstance(img, Image):
+            return img
+        if isinstance(img, (bytes, bytearray)):
+            # Same decoding as the cv2_rgb operator, so that a query image gets the vector it was indexed with
+            bgr = cv2.imdecode(np.frombuffer(img, np.uint8), cv2.IMREAD_COLOR)
+            if bgr is None:
+                raise ValueError("Can not decode the image content")
+            img = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+        if isinstance(img, np.ndarray):
+            return Image(img, 'RGB')
+        return self.image_decode(img)
+
+    def safe_decode(self, img):
+        # Decode one image, return None if it can not be read
+        try:
+            return self.decode(img)
+        except Exception as e:
+            LOGGER.error(f"Error with decoding image {img if isinstance(img, str) else 'in memory'}: {e}")
+            return None
+
+    def embed(self, imgs):
+        # Embed a list of decoded images with one batched forward pass
+        feats = self.image_embedding(list(imgs))
+        return [self.normalize(feat) for feat in feats]
+
+    def resnet50_extract_feat(self, img):
+        # img is a path, an url, the raw bytes of an image file or an RGB ndarray
+        return self.query_batcher.submit(self.decode(img)).result()
+
+    def resnet50_extract_list(self, imgs, batch_size=LOAD_BATCH_SIZE):
+        # Return the normalized feature of every image, None for the images that can not be decoded
+        decoded = list(self.decode_pool.map(self.safe_decode, imgs))
+        feats = [None] * len(decoded)
+        valid = [i for i, img in enumerate(decoded) if img is not None]
+        for start in range(0, len(valid), batch_size):
+            batch = valid[start:start + batch_size]
+            for i, feat in zip(batch, self.embed(decoded[i] for i in batch)):
+                feats[i] = feat
+        return feats
+
+    def resnet50_extract_batches(self, img_paths, batch_size=LOAD_BATCH_SIZE):
+        # Yield (paths, feats) batch by batch, the next batch is decoded while the current one is embedded
+        batches = [img_paths[i:i + batch_size] for i in range(0, len(img_paths), batch_size)]
+        if not batches:
+            return
+        pending = [self.decode_pool.submit(self.safe_decode, path) for path in batches[0]]
+        for n, batch in enumerate(batches):
+            imgs = [future.result() for future in pending]
+            if n + 1 < len(batches):
+                pending = [self.decode_pool.submit(self.safe_decode, path) for path in batches[n + 1]]
+            yield self._embed_decoded(batch, imgs)
+
+    def _embed_decoded(self, img_paths, imgs):
+        pairs = [(path, img) for path, img in zip(img_paths, imgs) if img is not None]
+        if not pairs:
+            return [], []
+        paths = [path for path, _ in pairs]
+        feats = self.embed(img for _, img in pairs)
+        return paths, feats
 
 
 if __name__ == '__main__':
@@ -0,0 +1,139 @@
+import io
+import os
+import re
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from PIL import Image
+from diskcache import Cache
+from starlette.responses import Response, StreamingResponse
+from config import THUMBNAIL_PATH, THUMBNAIL_CACHE_SIZE, THUMBNAIL_SIZES, THUMBNAIL_QUALITY, IMAGE_CACHE_MAX_AGE
+
+CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_sizes(sizes):
+    # "small:128,medium:320" -> {"small": 128, "medium": 320}
+    presets = {}
+    for entry in sizes.split(','):
+        name, _, px = entry.partition(':')
+        if name.strip() and px.strip():
+            presets[name.strip()] = int(px)
+    return presets
+
+
+SIZE_PRESETS = parse_sizes(THUMBNAIL_SIZES)
+
+
+class ThumbnailCache:
+    """
+    On disk cache of the JPEG thumbnails of the images, one per size preset.
+
+    Thumbnails are made on the first request and keyed by the path, mtime and size of the image,
+    so a modified image gets a new thumbnail. The least recently used ones are evicted once the
+    cache is larger than size_limit bytes.
+    """
+    def __init__(self, cache_path=THUMBNAIL_PATH, size_limit=THUMBNAIL_CACHE_SIZE):
+        self.cache = Cache(cache_path, size_limit=size_limit, eviction_policy='least-recently-used')
+
+    @staticmethod
+    def make(image_path, px):
+        with Image.open(image_path) as img:
+            img = img.convert('RGB')
+            img.thumbnail((px, px))
+            buf = io.BytesIO()
+            img.save(buf, format='JPEG', quality=THUMBNAIL_QUALITY)
+            return buf.getvalue()
+
+    def get(self, image_path, preset, stat):
+        key = f"{os.path.abspath(image_path)}:{stat.st_mtime_ns}:{stat.st_size}:{preset}"
+        content = self.cache.get(key)
+        if content is None:
+            content = self.make(image_path, SIZE_PRESETS[preset])
+            self.cache.set(key, content)
+        return content
+
+
+THUMBNAILS = ThumbnailCache()
+
+
+def cache_headers(stat, suffix=''):
+    return {
+        "etag": f'"{stat.st_mtime_ns:x}-{stat.st_size:x}{suffix}"',
+        "last-modified": formatdate(stat.st_mtime, usegmt=True),
+        "cache-control": f"public, max-age={IMAGE_CACHE_MAX_AGE}",
+    }
+
+
+def not_modified(request_headers, headers, stat):
+    # Check If-None-Match first, If-Modified-Since only applies without it
+    if_none_match = request_headers.get('if-none-match')
+    if if_none_match is not None:
+        return headers["etag"] in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+    if_modified_since = request_headers.get('if-modified-since')
+    if if_modified_since:
+        try:
+            return int(stat.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def parse_range(range_header, size):
+    # Get the (start, end) of a single byte range, None to send the whole file, ValueError if unsatisfiable
+    match = RANGE_RE.match(range_header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start > end or start >= size:
+        raise ValueError(range_header)
+    return start, end
+
+
+def iter_file(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_image(request_headers, image_path, size=None):
+    # Serve the image or its thumbnail with validators, answering conditional and range requests
+    stat = os.stat(image_path)
+    if size is not None:
+        if size not in SIZE_PRESETS:
+            raise ValueError(f"Unknown size: {size}, expected one of {list(SIZE_PRESETS)}")
+        headers = cache_headers(stat, f"-{size}")
+        if not_modified(request_headers, headers, stat):
+            return Response(status_code=304, headers=headers)
+        return Response(THUMBNAILS.get(image_path, size, stat), media_type='image/jpeg', headers=headers)
+    headers = cache_headers(stat)
+    headers["accept-ranges"] = "bytes"
+    if not_modified(request_headers, headers, stat):
+        return Response(status_code=304, headers=headers)
+    media_type = mimetypes.guess_type(image_path)[0] or 'application/octet-stream'
+    byte_range = None
+    range_header = request_headers.get('range')
+    # A range applies only if the If-Range validator still matches
+    if range_header and request_headers.get('if-range', headers["etag"]) == headers["etag"]:
+        try:
+            byte_range = parse_range(range_header, stat.st_size)
+        except ValueError:
+            headers["content-range"] = f"bytes */{stat.st_size}"
+            return Response(status_code=416, headers=headers)
+    start, end = byte_range or (0, stat.st_size - 1)
+    headers["content-length"] = str(end - start + 1)
+    if byte_range is not None:
+        headers["content-range"] = f"bytes {start}-{end}/{stat.st_size}"
+    return StreamingResponse(iter_file(image_path, start, end - start + 1), status_code=206 if byte_range else 200,
+                             media_type=media_type, headers=headers)
@@ -0,0 +1,63 @@
+import math
+from config import METRIC_TYPE, INDEX_TYPE, TABLE_INDEX_TYPES, AUTO_FLAT_MAX_ROWS, AUTO_HNSW_MAX_ROWS, \
+    AUTO_IVF_MAX_ROWS, IVF_NLIST, IVF_NPROBE, PQ_M, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF, DISKANN_SEARCH_LIST
+
+INDEX_TYPES = ('FLAT', 'IVF_FLAT', 'IVF_SQ8', 'IVF_PQ', 'HNSW', 'DISKANN')
+
+
+def auto_index_type(num):
+    # Exact search while a table is small, then a graph index, then compressed and on disk indexes for memory
+    if num < AUTO_FLAT_MAX_ROWS:
+        return 'FLAT'
+    if num < AUTO_HNSW_MAX_ROWS:
+        return 'HNSW'
+    if num < AUTO_IVF_MAX_ROWS:
+        return 'IVF_SQ8'
+    return 'DISKANN'
+
+
+def is_auto(table_name):
+    return table_index_type_setting(table_name) == 'AUTO'
+
+
+def table_index_type_setting(table_name):
+    # TABLE_INDEX_TYPES is a comma separated list of table:index_type, other tables use INDEX_TYPE
+    for entry in TABLE_INDEX_TYPES.split(','):
+        name, _, index_type = entry.partition(':')
+        if name.strip() == table_name and index_type:
+            return index_type.strip().upper()
+    return INDEX_TYPE.upper()
+
+
+def choose_index_type(table_name, num):
+    index_type = table_index_type_setting(table_name)
+    if index_type == 'AUTO':
+        return auto_index_type(num)
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unsupported index type: {index_type}, expected one of {INDEX_TYPES}")
+    return index_type
+
+
+def index_params(index_type, num):
+    # Build params of the index type for a collection of num rows
+    if index_type.startswith('IVF_'):
+        nlist = IVF_NLIST or min(max(int(4 * math.sqrt(num)), 128), 65536)
+        params = {"nlist": nlist}
+        if index_type == 'IVF_PQ':
+            params["m"] = PQ_M
+        return {"metric_type": METRIC_TYPE, "index_type": index_type, "params": params}
+    if index_type == 'HNSW':
+        return {"metric_type": METRIC_TYPE, "index_type": index_type,
+                "params": {"M": HNSW_M, "efConstruction": HNSW_EF_CONSTRUCTION}}
+    return {"metric_type": METRIC_TYPE, "index_type": index_type, "params": {}}
+
+
+def search_params(index_type, params, top_k):
+    # Search params matching the index of the collection
+    if index_type.startswith('IVF_'):
+        return {"metric_type": METRIC_TYPE, "params": {"nprobe": min(IVF_NPROBE, int(params.get("nlist", IVF_NPROBE)))}}
+    if index_type == 'HNSW':
+        return {"metric_type": METRIC_TYPE, "params": {"ef": max(HNSW_EF, top_k)}}
+    if index_type == 'DISKANN':
+        return {"metric_type": METRIC_TYPE, "params": {"search_list": max(DISKANN_SEARCH_LIST, top_k)}}
+    return {"metric_type": METRIC_TYPE, "params": {}}
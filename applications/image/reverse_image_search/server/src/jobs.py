@@ -0,0 +1,63 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from diskcache import Cache
+from config import LOAD_JOB_WORKERS, JOB_TTL
+from logs import LOGGER
+
+
+class JobManager:
+    """
+    Background executor for long running operations such as bulk loads.
+
+    Every job gets an id, and its status and progress are kept in diskcache
+    under `job:<id>`, so several jobs can report progress at the same time.
+    """
+    def __init__(self, cache_path='./tmp', max_workers=LOAD_JOB_WORKERS):
+        self.cache = Cache(cache_path)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+
+    @staticmethod
+    def key(job_id):
+        return f"job:{job_id}"
+
+    def submit(self, func, *args, **kwargs):
+        # Queue func(*args, progress=<callback>, **kwargs) and return the job id
+        job_id = uuid.uuid4().hex
+        job = {"job_id": job_id, "status": "pending", "current": 0, "total": 0, "msg": None,
+               "created": time.time(), "finished": None}
+        self.cache.set(self.key(job_id), job, expire=JOB_TTL)
+        self.cache['last_job'] = job_id
+        self.executor.submit(self._run, job_id, func, args, kwargs)
+        return job_id
+
+    def get(self, job_id):
+        return self.cache.get(self.key(job_id))
+
+    def last(self):
+        job_id = self.cache.get('last_job')
+        return self.get(job_id) if job_id else None
+
+    def update(self, job_id, **fields):
+        # Only the thread running the job writes to its entry
+        job = self.get(job_id)
+        if job is None:
+            return
+        job.update(fields)
+        self.cache.set(self.key(job_id), job, expire=JOB_TTL)
+
+    def progress(self, job_id):
+        def report(current, total):
+            self.update(job_id, current=current, total=total)
+        return report
+
+    def _run(self, job_id, func, args, kwargs):
+        self.update(job_id, status="running")
+        try:
+            result = func(*args, progress=self.progress(job_id), **kwargs)
+            self.update(job_id, status="finished", msg=result, finished=time.time())
+            LOGGER.info(f"Job {job_id} finished: {result}")
+        except (Exception, SystemExit) as e:
+            # The helpers call sys.exit on errors, which must only end this job
+            self.update(job_id, status="failed", msg=str(e) or repr(e), finished=time.time())
+            LOGGER.error(f"Job {job_id} failed: {e!r}")
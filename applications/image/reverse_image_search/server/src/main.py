@@ -1,25 +1,36 @@
 import uvicorn
 import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from diskcache import Cache
 from fastapi import FastAPI, File, UploadFile, Query
 from fastapi.param_functions import Form
 from starlette.middleware.cors import CORSMiddleware
-from starlette.responses import FileResponse
+from starlette.requests import Request
 from encode import Resnet50
-from milvus_helpers import MilvusHelper
+from milvus_helpers import MilvusHelper, CollectionRebuilding
 from mysql_helpers import MySQLHelper
-from config import TOP_K, UPLOAD_PATH
+from config import TOP_K, UPLOAD_PATH, REQUEST_WORKERS, PRELOAD_COLLECTIONS
 from operations.load import do_load
 from operations.upload import do_upload
+from operations.bulk_upload import do_bulk_upload
 from operations.search import do_search
+from operations.batch_search import do_batch_search
 from operations.count import do_count
 from operations.drop import do_drop
+from operations.rebuild_index import do_rebuild_index
 from operations.delete_by_id import do_delete_by_id
+from operations.bulk_delete import do_bulk_delete
 from operations.get_all import do_get_all
+from jobs import JobManager
+from index_profiles import INDEX_TYPES
+from search_cache import SEARCH_CACHE
+from image_serving import serve_image
 from logs import LOGGER
 from pydantic import BaseModel
 from typing import Optional, List, Dict
-from urllib.request import urlretrieve
+from urllib.request import urlopen
 from fastapi import HTTPException
 
 app = FastAPI()
@@ -34,6 +45,9 @@
 MODEL = Resnet50()
 MILVUS_CLI = MilvusHelper()
 MYSQL_CLI = MySQLHelper()
+JOBS = JobManager()
+# Blocking model and database calls of the handlers run on this pool instead of the event loop
+REQUEST_POOL = ThreadPoolExecutor(max_workers=REQUEST_WORKERS, thread_name_prefix='request')
 
 # Mkdir '/tmp/search-images',系统默认存储上传图片的位置
 if not os.path.exists(UPLOAD_PATH):
@@ -41,26 +55,54 @@
     LOGGER.info(f"mkdir the path:{UPLOAD_PATH}")
 
 
+@app.on_event("startup")
+def warm_up():
+    # Load the collections before serving, so that the first searches do not pay for it
+    if PRELOAD_COLLECTIONS == '*':
+        MILVUS_CLI.preload()
+    elif PRELOAD_COLLECTIONS:
+        MILVUS_CLI.preload(PRELOAD_COLLECTIONS.split(','))
+
+
+async def run_in_pool(func, *args):
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(REQUEST_POOL, functools.partial(func, *args))
+
+
+def save_file(path, content):
+    with open(path, "wb+") as f:
+        f.write(content)
+
+
+def read_url(url):
+    with urlopen(url) as response:
+        return response.read()
+
+
 # 用于直接取得图源中的图片：前端参照该路径：http://127.0.0.1:5000/data?image_path=tmp/search-images
+# size 为缩略图规格（如 small、medium、large），不传则返回原图；支持 ETag/Last-Modified 协商缓存和 Range 请求
 @app.get('/data')
-def get_img(image_path):
+def get_img(request: Request, image_path: str, size: str = None):
     # Get the image file
     try:
-        LOGGER.info(f"Successfully load image: {image_path}")
-        return FileResponse(image_path)
+        LOGGER.debug(f"Successfully load image: {image_path}")
+        return serve_image(request.headers, image_path, size)
     except Exception as e:
         LOGGER.error(f"Get image error: {e}")
         return {'status': False, 'msg': e}, 400
 
 
 @app.get('/progress')
-def get_progress(cache_path: str = './tmp'):
-    # Get the progress of dealing with images
+def get_progress(job_id: str = None, cache_path: str = './tmp'):
+    # Get the progress of dealing with images, of the given load job or of the latest one
     try:
-        cache = Cache(cache_path)
+        job = JOBS.get(job_id) if job_id else JOBS.last()
+        if job is None:
+            cache = Cache(cache_path)
+            job = {"current": cache.get('current', 0), "total": cache.get('total', 0)}
         progress = {
-            "current": cache.get('current', 0),
-            "total": cache.get('total', 0)
+            "current": job["current"],
+            "total": job["total"]
         }
         return progress
     except Exception as e:
@@ -68,6 +110,15 @@ def get_progress(cache_path: str = './tmp'):
         return {'status': False, 'msg': str(e)}, 400
 
 
+@app.get('/jobs/{job_id}')
+def get_job(job_id: str):
+    # Get the status and progress of a background job
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No job with id: {job_id}")
+    return job
+
+
 class Item(BaseModel):
     Table: str  # 修改为必需参数
     File: str
@@ -78,12 +129,20 @@ class ImageData(BaseModel):
     image_path: str
 
 
+class BulkDeleteItem(BaseModel):
+    table_name: str
+    milvus_ids: Optional[List[int]] = None
+    path_prefix: Optional[str] = None
+    remove_files: bool = True
+
+
 class PaginatedResponse(BaseModel):
-    total: int
-    total_pages: int
+    total: Optional[int] = None
+    total_pages: Optional[int] = None
     current_page: int
     page_size: int
     data: List[ImageData]
+    next_cursor: Optional[str] = None
 
 
 # 此接口用于将部门图源全部转为图源特征存入向量数据库部门表中,item为图源路径
@@ -94,9 +153,10 @@ async def load_images(item: Item):
         if not item.Table:
             return {'status': False, 'msg': 'Table name is required'}, 400
             
-        total_num = do_load(item.Table, item.File, MODEL, MILVUS_CLI, MYSQL_CLI)
-        LOGGER.info(f"Successfully loaded data to table {item.Table}, total count: {total_num}")
-        return "Successfully loaded data!"
+        # 导入在后台任务中执行，通过 /jobs/{job_id} 查询进度
+        job_id = JOBS.submit(do_load, item.Table, item.File, MODEL, MILVUS_CLI, MYSQL_CLI)
+        LOGGER.info(f"Submitted load job {job_id} for table {item.Table}")
+        return {'status': True, 'job_id': job_id}
     except Exception as e:
         LOGGER.error(e)
         return {'status': False, 'msg': str(e)}, 400
@@ -115,32 +175,30 @@ async def upload_images(image: UploadFile = File(None), url: str = None, table_n
             if not os.path.exists(new_path):
                 os.makedirs(new_path)
                 LOGGER.info(f"mkdir the path:{new_path}")
+            # The image is saved by do_upload, unless it is a duplicate
             if image is not None:
                 content = await image.read()
                 img_path = os.path.join(new_path, image.filename)
-                with open(img_path, "wb+") as f:
-                    f.write(content)
             elif url is not None:
+                content = await run_in_pool(read_url, url)
                 img_path = os.path.join(new_path, os.path.basename(url))
-                urlretrieve(url, img_path)
             else:
                 return {'status': False, 'msg': 'Image and url are required'}, 400
-            vector_id = do_upload(table_name, img_path, MODEL, MILVUS_CLI, MYSQL_CLI)
+            vector_id = await run_in_pool(do_upload, table_name, img_path, MODEL, MILVUS_CLI, MYSQL_CLI, content)
             LOGGER.info(f"Successfully uploaded data, vector id: {vector_id}")
             return "Successfully loaded data: " + str(vector_id)
         else:
             # Save the upload image to server.
+            # The image is saved by do_upload, unless it is a duplicate
             if image is not None:
                 content = await image.read()
                 img_path = os.path.join(UPLOAD_PATH, image.filename)
-                with open(img_path, "wb+") as f:
-                    f.write(content)
             elif url is not None:
+                content = await run_in_pool(read_url, url)
                 img_path = os.path.join(UPLOAD_PATH, os.path.basename(url))
-                urlretrieve(url, img_path)
             else:
                 return {'status': False, 'msg': 'Image and url are required'}, 400
-            vector_id = do_upload(table_name, img_path, MODEL, MILVUS_CLI, MYSQL_CLI)
+            vector_id = await run_in_pool(do_upload, table_name, img_path, MODEL, MILVUS_CLI, MYSQL_CLI, content)
             LOGGER.info(f"Successfully uploaded data, vector id: {vector_id}")
             return "Successfully loaded data: " + str(vector_id)
     except Exception as e:
@@ -148,6 +206,29 @@ async def upload_images(image: UploadFile = File(None), url: str = None, table_n
         return {'status': False, 'msg': e}, 400
 
 
+# 批量上传：一次传入多张图片和/或多个图片网络地址，在后台任务中下载、提取特征并批量写入
+# new_path为部门图源路径，通过 /jobs/{job_id} 查询进度
+@app.post('/img/bulk_upload')
+async def bulk_upload_images(images: List[UploadFile] = File(None), urls: List[str] = Query(None),
+                             table_name: str = None, new_path: str = None):
+    # Insert many upload images and urls to Milvus/MySQL
+    try:
+        if not images and not urls:
+            return {'status': False, 'msg': 'Images or urls are required'}, 400
+        img_dir = new_path or UPLOAD_PATH
+        if not os.path.exists(img_dir):
+            os.makedirs(img_dir)
+            LOGGER.info(f"mkdir the path:{img_dir}")
+        # The images are saved by the job, once the copies are skipped
+        uploads = [(image.filename, await image.read()) for image in images or []]
+        job_id = JOBS.submit(do_bulk_upload, table_name, uploads, urls, img_dir, MODEL, MILVUS_CLI, MYSQL_CLI)
+        LOGGER.info(f"Submitted bulk upload job {job_id} of {len(uploads)} images and {len(urls or [])} urls")
+        return {'status': True, 'job_id': job_id}
+    except Exception as e:
+        LOGGER.error(e)
+        return {'status': False, 'msg': str(e)}, 400
+
+
 # 图搜 需要传入向量数据库部门表名
 # str为传入的网络图片地址
 @app.post('/img/search')
@@ -158,14 +239,42 @@ async def search_images(
 ):
     try:
         content = await image.read()
-        img_path = os.path.join(UPLOAD_PATH, image.filename)
-        with open(img_path, "wb+") as f:
-            f.write(content)
-        paths, distances = do_search(table_name, img_path, topk, MODEL, MILVUS_CLI, MYSQL_CLI)
+        # A repeated query image is answered from the cache, without being saved or embedded
+        img_hash = SEARCH_CACHE.hash(content)
+        cached = SEARCH_CACHE.lookup(table_name, img_hash, topk)
+        if cached is not None:
+            paths, distances = cached
+        else:
+            # The query image is embedded from memory, only /img/upload persists images
+            paths, distances = await run_in_pool(do_search, table_name, content, topk, MODEL, MILVUS_CLI, MYSQL_CLI,
+                                                 img_hash)
         res = dict(zip(paths, distances))
         res = sorted(res.items(), key=lambda item: item[1])
         LOGGER.info(f"Successfully searched similar images in table {table_name}!")
         return res
+    except CollectionRebuilding as e:
+        LOGGER.warning(e)
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        LOGGER.error(e)
+        return {'status': False, 'msg': str(e)}, 400
+
+
+# 批量图搜：一次传入多张图片，按上传顺序返回每张图片的相似图片，无法解码的图片返回null
+@app.post('/img/batch_search')
+async def batch_search_images(
+    images: List[UploadFile] = File(...),
+    topk: int = Form(TOP_K),
+    table_name: str = Form(..., description="部门向量数据库表名")
+):
+    try:
+        contents = [await image.read() for image in images]
+        results = await run_in_pool(do_batch_search, table_name, contents, topk, MODEL, MILVUS_CLI, MYSQL_CLI)
+        LOGGER.info(f"Successfully searched similar images of {len(images)} images in table {table_name}!")
+        return [{"filename": image.filename, "results": res} for image, res in zip(images, results)]
+    except CollectionRebuilding as e:
+        LOGGER.warning(e)
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         LOGGER.error(e)
         return {'status': False, 'msg': str(e)}, 400
@@ -175,7 +284,7 @@ async def search_images(
 async def count_images(table_name: str = None):
     # Returns the total number of images in the system
     try:
-        num = do_count(table_name, MILVUS_CLI)
+        num = await run_in_pool(do_count, table_name, MILVUS_CLI)
         LOGGER.info("Successfully count the number of images!")
         return num
     except Exception as e:
@@ -183,6 +292,20 @@ async def count_images(table_name: str = None):
         return {'status': False, 'msg': e}, 400
 
 
+# 重建部门向量数据库表的索引，index_type为空时按配置或表的数据量选择，通过 /jobs/{job_id} 查询进度
+@app.post('/img/rebuild_index')
+async def rebuild_index(table_name: str = Query(..., description="部门向量数据库表名"), index_type: str = None):
+    try:
+        if index_type and index_type.upper() not in INDEX_TYPES:
+            return {'status': False, 'msg': f'Index type must be one of {INDEX_TYPES}'}, 400
+        job_id = JOBS.submit(do_rebuild_index, table_name, index_type, MILVUS_CLI)
+        LOGGER.info(f"Submitted rebuild index job {job_id} for table {table_name}")
+        return {'status': True, 'job_id': job_id}
+    except Exception as e:
+        LOGGER.error(e)
+        return {'status': False, 'msg': str(e)}, 400
+
+
 # 用于删除指定部门的向量数据库表，同时删除对应的数据库表，名字相同
 @app.post('/img/drop')
 async def drop_tables(table_name: str = Query(..., description="部门向量数据库表名")):
@@ -190,7 +313,7 @@ async def drop_tables(table_name: str = Query(..., description="部门向量数
         if not table_name:
             return {'status': False, 'msg': 'Table name is required'}, 400
             
-        status = do_drop(table_name, MILVUS_CLI, MYSQL_CLI)
+        status = await run_in_pool(do_drop, table_name, MILVUS_CLI, MYSQL_CLI)
         LOGGER.info(f"Successfully dropped table {table_name} in Milvus and MySQL!")
         return status
     except Exception as e:
@@ -203,21 +326,10 @@ async def drop_tables(table_name: str = Query(..., description="部门向量数
 async def delete_by_id(table_name: str, milvus_id: int):
     print(f"将上传的信息 {table_name} #### {milvus_id}")
     try:
-        # 删除 MySQL 中的数据
-        status = do_delete_by_id(table_name, milvus_id, MILVUS_CLI, MYSQL_CLI)
+        # 删除 Milvus 和 MySQL 中的数据，do_delete_by_id 同时删除本地图片文件
+        status = await run_in_pool(do_delete_by_id, table_name, milvus_id, MILVUS_CLI, MYSQL_CLI)
 
         if status:
-            # 获取图片路径
-            image_path = MYSQL_CLI.get_image_path_by_id(table_name, str(milvus_id))
-
-            if image_path:
-                # 删除本地数据（文件）
-                if os.path.exists(image_path):
-                    os.remove(image_path)
-                    LOGGER.info(f"Successfully deleted local data (image) at {image_path}")
-                else:
-                    LOGGER.warning(f"Local file at {image_path} does not exist")
-
             LOGGER.info(f"Successfully deleted data with id:{milvus_id} from table:{table_name}")
             return {"status": True, "msg": "Successfully deleted data"}
         else:
@@ -227,15 +339,28 @@ async def delete_by_id(table_name: str, milvus_id: int):
         raise HTTPException(status_code=400, detail=str(e))
 
 
+# 批量删除：按 milvus_id 列表和/或图片路径前缀删除数据，remove_files 为真时同时删除本地图片文件
+@app.post('/img/bulk_delete')
+async def bulk_delete(item: BulkDeleteItem):
+    try:
+        num = await run_in_pool(do_bulk_delete, item.table_name, item.milvus_ids, item.path_prefix, MILVUS_CLI,
+                                MYSQL_CLI, item.remove_files)
+        return {"status": True, "msg": f"Successfully deleted {num} images", "count": num}
+    except Exception as e:
+        LOGGER.error(f"Error: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 # 获取指定表的所有数据（分页）
 @app.get('/img/all/{table_name}', response_model=PaginatedResponse)
 async def get_all_data(
     table_name: str,
     page: int = Query(1, ge=1, description="页码，从1开始"),
-    size: int = Query(10, ge=1, le=100, description="每页数量，1-100之间")
+    size: int = Query(10, ge=1, le=100, description="每页数量，1-100之间"),
+    after: Optional[int] = Query(None, description="上一页返回的 next_cursor，传入后按游标分页，忽略页码")
 ):
     try:
-        data = do_get_all(table_name, MYSQL_CLI, page, size)
+        data = await run_in_pool(do_get_all, table_name, MYSQL_CLI, page, size, after)
         LOGGER.info(f"Successfully got data from table:{table_name}, page:{page}, size:{size}")
         return data
     except Exception as e:
@@ -0,0 +1,62 @@
+import os
+from diskcache import Cache
+from config import MANIFEST_PATH
+from logs import LOGGER
+
+
+class LoadManifest:
+    """
+    Checkpoint manifest of the images committed to Milvus and MySQL.
+
+    Every entry is keyed by table name and absolute image path, and stores the (mtime, size)
+    fingerprint of the file together with its milvus id, so a restarted load can skip
+    the images that are already in the table.
+    """
+    def __init__(self, cache_path=MANIFEST_PATH):
+        self.cache = Cache(cache_path, tag_index=True)
+
+    @staticmethod
+    def key(table_name, img_path):
+        return f"{table_name}:{os.path.abspath(img_path)}"
+
+    @staticmethod
+    def fingerprint(img_path):
+        stat = os.stat(img_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def is_committed(self, table_name, img_path):
+        # Return if the image is committed to the table and not modified since
+        entry = self.cache.get(self.key(table_name, img_path))
+        try:
+            return entry is not None and entry[0] == self.fingerprint(img_path)
+        except OSError:
+            return False
+
+    def previous_id(self, table_name, img_path):
+        # Get the milvus id the image was committed with, None if it was never committed
+        entry = self.cache.get(self.key(table_name, img_path))
+        return entry[1] if entry is not None else None
+
+    def stale_ids(self, table_name, img_paths):
+        # Get the milvus ids of the earlier versions of modified images
+        ids = [self.previous_id(table_name, img_path) for img_path in img_paths]
+        return [milvus_id for milvus_id in ids if milvus_id is not None]
+
+    def commit(self, table_name, img_paths, ids):
+        # Record the images once their vectors and paths are written to both stores
+        with self.cache.transact():
+            for img_path, milvus_id in zip(img_paths, ids):
+                self.cache.set(self.key(table_name, img_path), (self.fingerprint(img_path), milvus_id),
+                               tag=table_name)
+        LOGGER.debug(f"Commit {len(ids)} images of table {table_name} to manifest")
+
+    def discard(self, table_name, img_path):
+        self.cache.delete(self.key(table_name, img_path))
+
+    def clear_table(self, table_name):
+        num = self.cache.evict(table_name)
+        LOGGER.debug(f"Clear {num} manifest entries of table {table_name}")
+        return num
+
+
+MANIFEST = LoadManifest()
@@ -1,7 +1,57 @@
 import sys
-from config import MILVUS_HOST, MILVUS_PORT, VECTOR_DIMENSION, METRIC_TYPE
+import time
+import threading
+from contextlib import contextmanager
+from config import MILVUS_HOST, MILVUS_PORT, VECTOR_DIMENSION, COUNT_MAX_STALENESS, STORAGE_MODE, \
+    PATH_MAX_LENGTH, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, SEARCH_WORKERS, DELETE_BATCH_SIZE, COMPACT_DELETED_RATIO
 from pymilvus import connections, FieldSchema, CollectionSchema, DataType, Collection, utility
 from logs import LOGGER
+from batching import MicroBatcher
+from index_profiles import choose_index_type, index_params, search_params, is_auto
+
+
+class CollectionRebuilding(Exception):
+    """
+    Raised by a search of a collection whose index is being rebuilt.
+    """
+
+
+class CollectionLock:
+    """
+    Lets the searches of a collection run concurrently, while an index rebuild waits for the running
+    searches. The searches that start during the rebuild fail with CollectionRebuilding instead of
+    waiting, so that they do not hold the shared search and request threads for the whole build.
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.readers = 0
+        self.writing = False
+
+    @contextmanager
+    def read(self, collection_name):
+        with self.cond:
+            if self.writing:
+                raise CollectionRebuilding(f"The index of collection {collection_name} is being rebuilt, retry later")
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.readers -= 1
+                self.cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self.cond:
+            self.cond.wait_for(lambda: not self.writing)
+            self.writing = True
+            self.cond.wait_for(lambda: self.readers == 0)
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.writing = False
+                self.cond.notify_all()
 
 
 class MilvusHelper:
@@ -10,20 +60,84 @@ class MilvusHelper:
     """
     def __init__(self):
         try:
-            self.collection = None
+            # Collection handles are cached per collection, and the collections loaded into memory are tracked,
+            # so the search path goes straight to collection.search
+            self.collections = {}
+            self.loaded = set()
+            self.lock = threading.Lock()
+            # collection name -> CollectionLock, held by the searches and by an index rebuild of the collection
+            self.collection_locks = {}
+            # collection name -> (num, time), served by count for up to COUNT_MAX_STALENESS seconds
+            self.counts = {}
+            # collection name -> (index type, build params), the search params are derived from it
+            self.indexes = {}
+            # collection name -> number of rows deleted since its last compaction by this process
+            self.deleted = {}
             connections.connect(host=MILVUS_HOST, port=MILVUS_PORT)
             LOGGER.debug(f"Successfully connect to Milvus with IP:{MILVUS_HOST} and PORT:{MILVUS_PORT}")
+            # Single vector searches of concurrent requests on the same collection and top_k are sent as one search
+            self.search_batcher = MicroBatcher(lambda key, vectors: list(self.search_vectors(key[0], vectors, key[1], list(key[2]))),
+                                               BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS / 1000, workers=SEARCH_WORKERS,
+                                               name='search')
         except Exception as e:
             LOGGER.error(f"Failed to connect Milvus: {e}")
             sys.exit(1)
 
-    def set_collection(self, collection_name):
+    def get_collection(self, collection_name):
+        # Return the cached collection handle, methods keep it local so that they are safe to call from several threads
+        collection = self.collections.get(collection_name)
+        if collection is not None:
+            return collection
         try:
-            self.collection = Collection(name=collection_name)
+            collection = Collection(name=collection_name)
+            self.collections[collection_name] = collection
+            return collection
         except Exception as e:
             LOGGER.error(f"Failed to set collection in Milvus: {e}")
             sys.exit(1)
 
+    def collection_lock(self, collection_name):
+        lock = self.collection_locks.get(collection_name)
+        if lock is None:
+            with self.lock:
+                lock = self.collection_locks.setdefault(collection_name, CollectionLock())
+        return lock
+
+    def load_collection(self, collection_name):
+        # Load the collection into memory once
+        if collection_name in self.loaded:
+            return
+        with self.lock:
+            if collection_name in self.loaded:
+                return
+            try:
+                self.get_collection(collection_name).load()
+                self.loaded.add(collection_name)
+                LOGGER.debug(f"Successfully load collection: {collection_name}")
+            except Exception as e:
+                LOGGER.error(f"Failed to load collection in Milvus: {e}")
+                sys.exit(1)
+
+    def preload(self, collection_names=None):
+        # Warm up the handles and load the collections before serving searches, all of them by default
+        try:
+            if collection_names is None:
+                collection_names = utility.list_collections()
+            for collection_name in collection_names:
+                if utility.has_collection(collection_name):
+                    self.load_collection(collection_name)
+            LOGGER.info(f"Successfully preload collections: {collection_names}")
+        except Exception as e:
+            LOGGER.error(f"Failed to preload collections in Milvus: {e}")
+            sys.exit(1)
+
+    def forget_collection(self, collection_name):
+        self.collections.pop(collection_name, None)
+        self.loaded.discard(collection_name)
+        self.counts.pop(collection_name, None)
+        self.indexes.pop(collection_name, None)
+        self.deleted.pop(collection_name, None)
+
     def has_collection(self, collection_name):
         # Return if Milvus has the collection
         try:
@@ -38,20 +152,32 @@ def create_collection(self, collection_name):
             field1 = FieldSchema(name="id", dtype=DataType.INT64, description="int64", is_primary=True, auto_id=True)
             field2 = FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, description="float vector",
                                     dim=VECTOR_DIMENSION, is_primary=False)
-            schema = CollectionSchema(fields=[field1, field2], description="collection description")
-            self.collection = Collection(name=collection_name, schema=schema)
+            fields = [field1, field2]
+            if STORAGE_MODE == 'milvus':
+                # Keep the image path in the collection, so that search returns it without a MySQL lookup
+                fields.append(FieldSchema(name="image_path", dtype=DataType.VARCHAR, description="image path",
+                                          max_length=PATH_MAX_LENGTH))
+            schema = CollectionSchema(fields=fields, description="collection description")
+            self.collections[collection_name] = Collection(name=collection_name, schema=schema)
             LOGGER.debug(f"Create Milvus collection: {collection_name}")
             return "OK"
         except Exception as e:
             LOGGER.error(f"Failed create collection in Milvus: {e}")
             sys.exit(1)
 
-    def insert(self, collection_name, vectors):
-        # Batch insert vectors to milvus collection
+    def scalar_fields(self, collection_name):
+        # Get the names of the VARCHAR fields stored in the collection
+        collection = self.get_collection(collection_name)
+        return [field.name for field in collection.schema.fields if field.dtype == DataType.VARCHAR]
+
+    def insert(self, collection_name, vectors, scalars=None):
+        # Batch insert vectors to milvus collection, with the values of its scalar fields by field name
         try:
-            self.set_collection(collection_name)
+            collection = self.get_collection(collection_name)
             data = [vectors]
-            mr = self.collection.insert(data)
+            for field_name in self.scalar_fields(collection_name):
+                data.append(scalars[field_name])
+            mr = collection.insert(data)
             ids = mr.primary_keys
             LOGGER.debug(
                     f"Insert vectors to Milvus in collection: {collection_name} with {len(vectors)} rows")
@@ -60,13 +186,16 @@ def insert(self, collection_name, vectors):
             LOGGER.error(f"Failed to insert data to Milvus: {e}")
             sys.exit(1)
 
-    def create_index(self, collection_name):
-        # Create IVF_FLAT index on milvus collection
+    def create_index(self, collection_name, index_type=None):
+        # Create the index of the table on milvus collection, or the given index type
         try:
-            self.set_collection(collection_name)
-            default_index = {"metric_type": METRIC_TYPE, "index_type": "IVF_FLAT", "params": {"nlist": 2048}}
-            status = self.collection.create_index(field_name="embedding", index_params=default_index)
+            collection = self.get_collection(collection_name)
+            num = collection.num_entities
+            index_type = index_type or choose_index_type(collection_name, num)
+            default_index = index_params(index_type, num)
+            status = collection.create_index(field_name="embedding", index_params=default_index)
             if not status.code:
+                self.indexes[collection_name] = (index_type, default_index["params"])
                 LOGGER.debug(
                     f"Successfully create index in collection:{collection_name} with param:{default_index}")
                 return status
@@ -76,50 +205,188 @@ def create_index(self, collection_name):
             LOGGER.error(f"Failed to create index: {e}")
             sys.exit(1)
 
+    def has_index(self, collection_name):
+        # Return if the collection has an index, a new collection only gets one after its first load
+        if collection_name in self.indexes:
+            return True
+        try:
+            return self.get_collection(collection_name).has_index()
+        except Exception as e:
+            LOGGER.error(f"Failed to get index of collection: {e}")
+            sys.exit(1)
+
+    def get_index(self, collection_name):
+        # Get the (index type, build params) of the collection
+        index = self.indexes.get(collection_name)
+        if index is not None:
+            return index
+        try:
+            collection = self.get_collection(collection_name)
+            params = collection.indexes[0].params if collection.indexes else {}
+            index = (params.get("index_type", "FLAT"), params.get("params", {}))
+            self.indexes[collection_name] = index
+            return index
+        except Exception as e:
+            LOGGER.error(f"Failed to get index of collection: {e}")
+            sys.exit(1)
+
+    def rebuild_index(self, collection_name, index_type=None):
+        # Replace the index of the collection, with the index type of the table by default.
+        # Searches of the collection fail with CollectionRebuilding while it is released.
+        # On failure the previous index is restored and the collection is loaded again.
+        with self.collection_lock(collection_name).write():
+            collection = self.get_collection(collection_name)
+            previous = self.get_index(collection_name)[0]
+            try:
+                collection.flush()
+                self.loaded.discard(collection_name)
+                collection.release()
+                collection.drop_index()
+                self.indexes.pop(collection_name, None)
+                self.create_index(collection_name, index_type)
+                LOGGER.info(f"Successfully rebuild index of collection:{collection_name} as {self.indexes[collection_name]}")
+                return self.indexes[collection_name][0]
+            except (Exception, SystemExit) as e:
+                # create_index calls sys.exit on errors
+                LOGGER.error(f"Failed to rebuild index: {e}")
+                self.restore_index(collection_name, previous)
+                sys.exit(1)
+            finally:
+                self.load_collection(collection_name)
+
+    def restore_index(self, collection_name, index_type):
+        # Create the index type of the collection again if the failed rebuild dropped it
+        try:
+            collection = self.get_collection(collection_name)
+            if not collection.has_index():
+                self.indexes.pop(collection_name, None)
+                self.create_index(collection_name, index_type)
+                LOGGER.info(f"Restored index of collection:{collection_name} as {index_type}")
+        except (Exception, SystemExit) as e:
+            LOGGER.error(f"Failed to restore index of collection:{collection_name}: {e}")
+
+    def index_outdated(self, collection_name):
+        # Get the index type an AUTO table calls for at its current size, None if its index is still right.
+        # The rebuild is left to /img/rebuild_index, so that a load does not hold off the searches of the table.
+        if not is_auto(collection_name):
+            return None
+        index_type = choose_index_type(collection_name, self.get_collection(collection_name).num_entities)
+        if index_type != self.get_index(collection_name)[0]:
+            LOGGER.warning(f"Index of collection:{collection_name} should be rebuilt as {index_type}, "
+                           f"call /img/rebuild_index")
+            return index_type
+        return None
+
     def delete_collection(self, collection_name):
         # Delete Milvus collection
         try:
-            self.set_collection(collection_name)
-            self.collection.drop()
+            collection = self.get_collection(collection_name)
+            collection.drop()
+            self.forget_collection(collection_name)
             LOGGER.debug("Successfully drop collection!")
             return "ok"
         except Exception as e:
             LOGGER.error(f"Failed to drop collection: {e}")
             sys.exit(1)
 
-    def search_vectors(self, collection_name, vectors, top_k):
-        # Search vector in milvus collection
+    def search_vectors(self, collection_name, vectors, top_k, output_fields=None):
+        # Search vector in milvus collection, CollectionRebuilding while its index is rebuilt
         try:
-            self.set_collection(collection_name)
-            self.collection.load()
-            search_params = {"metric_type": METRIC_TYPE, "params": {"nprobe": 16}}
-            res = self.collection.search(vectors, anns_field="embedding", param=search_params, limit=top_k)
-            LOGGER.debug(f"Successfully search in collection: {res}")
+            with self.collection_lock(collection_name).read(collection_name):
+                self.load_collection(collection_name)
+                collection = self.get_collection(collection_name)
+                index_type, params = self.get_index(collection_name)
+                res = collection.search(vectors, anns_field="embedding", param=search_params(index_type, params, top_k),
+                                        limit=top_k,
+                                        output_fields=output_fields)
+            LOGGER.debug(f"Successfully search {len(vectors)} vectors in collection: {collection_name}",
+                         extra={'throttle': 'milvus_search'})
             return res
+        except CollectionRebuilding:
+            raise
         except Exception as e:
             LOGGER.error(f"Failed to search vectors in Milvus: {e}")
             sys.exit(1)
 
-    def count(self, collection_name):
-        # Get the number of milvus collection
+    def search_vector(self, collection_name, vector, top_k, output_fields=None):
+        # Search one vector, batched with the concurrent searches on the same collection
+        if self.collection_lock(collection_name).writing:
+            raise CollectionRebuilding(f"The index of collection {collection_name} is being rebuilt, retry later")
+        key = (collection_name, top_k, tuple(output_fields or ()))
+        return self.search_batcher.submit(vector, key=key).result()
+
+    def count(self, collection_name, max_staleness=COUNT_MAX_STALENESS):
+        # Get the number of milvus collection from its row count statistics, without forcing a flush.
+        # Rows still in growing segments are counted once Milvus seals them, and the result is cached
+        # for max_staleness seconds.
         try:
-            self.set_collection(collection_name)
-            self.collection.flush()
-            num = self.collection.num_entities
+            cached = self.counts.get(collection_name)
+            if cached is not None and time.monotonic() - cached[1] < max_staleness:
+                return cached[0]
+            collection = self.get_collection(collection_name)
+            num = collection.num_entities
+            self.counts[collection_name] = (num, time.monotonic())
             LOGGER.debug(f"Successfully get the num:{num} of the collection:{collection_name}")
             return num
         except Exception as e:
             LOGGER.error(f"Failed to count vectors in Milvus: {e}")
             sys.exit(1)
 
+    def flush(self, collection_name):
+        # Seal the growing segments of the collection, only called at the end of a bulk load or before indexing
+        try:
+            collection = self.get_collection(collection_name)
+            collection.flush()
+            self.counts.pop(collection_name, None)
+            LOGGER.debug(f"Successfully flush collection:{collection_name}")
+        except Exception as e:
+            LOGGER.error(f"Failed to flush collection in Milvus: {e}")
+            sys.exit(1)
+
     def delete_entity_by_id(self, collection_name, id):
         # Delete entity by id from milvus collection
         try:
-            self.set_collection(collection_name)
-            expr = f'id in [{id}]'
-            self.collection.delete(expr)
+            collection = self.get_collection(collection_name)
+            expr = f'id in [{int(id)}]'
+            collection.delete(expr)
+            self.count_deleted(collection_name, 1)
             LOGGER.debug(f"Successfully delete entity id:{id} from collection:{collection_name}")
             return True
         except Exception as e:
             LOGGER.error(f"Failed to delete entity from Milvus: {e}")
             return False
+
+    def delete_entities_by_ids(self, collection_name, ids, batch_size=DELETE_BATCH_SIZE):
+        # Delete entities by ids from milvus collection, batch_size ids per delete
+        try:
+            collection = self.get_collection(collection_name)
+            ids = [int(i) for i in ids]
+            for start in range(0, len(ids), batch_size):
+                collection.delete(f"id in {ids[start:start + batch_size]}")
+            self.count_deleted(collection_name, len(ids))
+            LOGGER.debug(f"Successfully delete {len(ids)} entities from collection:{collection_name}")
+            return True
+        except Exception as e:
+            LOGGER.error(f"Failed to delete entities from Milvus: {e}")
+            return False
+
+    def count_deleted(self, collection_name, num):
+        # Compact the collection once the deleted rows reach COMPACT_DELETED_RATIO of its rows,
+        # so that searches do not keep filtering the tombstones
+        with self.lock:
+            deleted = self.deleted.get(collection_name, 0) + num
+            self.deleted[collection_name] = deleted
+        self.counts.pop(collection_name, None)
+        total = self.count(collection_name)
+        if total and deleted / total >= COMPACT_DELETED_RATIO:
+            self.compact(collection_name)
+
+    def compact(self, collection_name):
+        # Start the compaction of the collection, Milvus runs it in the background
+        try:
+            collection = self.get_collection(collection_name)
+            collection.compact()
+            self.deleted[collection_name] = 0
+            LOGGER.info(f"Successfully start compaction of collection:{collection_name}")
+        except Exception as e:
+            LOGGER.error(f"Failed to compact collection in Milvus: {e}")
@@ -1,75 +1,164 @@
 import sys
+import time
+import queue
+import threading
+from contextlib import contextmanager
 import pymysql
-from config import MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PWD, MYSQL_DB
+from config import MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PWD, MYSQL_DB, MYSQL_POOL_SIZE, MYSQL_PING_INTERVAL
 from logs import LOGGER
 
 
 class MySQLHelper():
     """
-    Say something about the ExampleCalass...
+    MySQL Helper
 
-    Args:
-        args_0 (`type`):
-        ...
+    Keeps a bounded pool of connections, every call borrows one and uses its own cursor,
+    so the helper can be shared by the request and job threads. A connection is health
+    checked when it is borrowed after being idle for more than MYSQL_PING_INTERVAL seconds.
     """
-    def __init__(self):
-        self.conn = pymysql.connect(host=MYSQL_HOST, user=MYSQL_USER, port=MYSQL_PORT, password=MYSQL_PWD,
-                                    database=MYSQL_DB,
-                                    local_infile=True)
-        self.cursor = self.conn.cursor()
+    def __init__(self, pool_size=MYSQL_POOL_SIZE):
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+        # Connect once eagerly to fail fast, the other connections are opened on demand
+        self.pool.put((self.connect(), time.monotonic()))
+        for _ in range(pool_size - 1):
+            self.pool.put((None, 0))
+        # Tables whose schema was checked, and migrated if needed, by this process
+        self.checked_tables = set()
+        # table name -> lock, so that concurrent first uses of a table do not migrate it twice
+        self.table_locks = {}
+        self.lock = threading.Lock()
 
-    def test_connection(self):
+    @staticmethod
+    def connect():
+        return pymysql.connect(host=MYSQL_HOST, user=MYSQL_USER, port=MYSQL_PORT, password=MYSQL_PWD,
+                               database=MYSQL_DB, local_infile=True)
+
+    @contextmanager
+    def get_cursor(self):
+        # Borrow a connection from the pool and yield a new cursor on it
+        conn, last_used = self.pool.get()
+        try:
+            if conn is None:
+                conn = self.connect()
+            elif time.monotonic() - last_used > MYSQL_PING_INTERVAL:
+                conn.ping(reconnect=True)
+            with conn.cursor() as cursor:
+                yield cursor
+            # End the transaction, so that a pooled connection does not keep an old REPEATABLE READ snapshot
+            conn.commit()
+        except Exception:
+            # A broken connection is closed and reopened on a later borrow
+            if conn is not None:
+                try:
+                    conn.rollback()
+                except Exception:
+                    self.close(conn)
+                    conn = None
+            raise
+        finally:
+            self.pool.put((conn, time.monotonic()))
+
+    @staticmethod
+    def close(conn):
         try:
-            self.conn.ping()
+            conn.close()
         except Exception:
-            self.conn = pymysql.connect(host=MYSQL_HOST, user=MYSQL_USER, port=MYSQL_PORT, password=MYSQL_PWD,
-                                    database=MYSQL_DB,local_infile=True)
-            self.cursor = self.conn.cursor()
+            pass
 
     def create_mysql_table(self, table_name):
-        # Create mysql table if not exists
-        self.test_connection()
-        sql = "create table if not exists " + table_name + "(milvus_id TEXT, image_path TEXT);"
+        # Create mysql table if not exists, milvus_id is the primary key and image_path has a prefix index
+        if table_name in self.checked_tables:
+            return
+        sql = "create table if not exists " + table_name + \
+              " (milvus_id BIGINT NOT NULL PRIMARY KEY, image_path TEXT, KEY idx_image_path (image_path(255)));"
         try:
-            self.cursor.execute(sql)
+            with self.get_cursor() as cursor:
+                cursor.execute(sql)
             LOGGER.debug(f"MYSQL create table: {table_name} with sql: {sql}")
         except Exception as e:
             LOGGER.error(f"MYSQL ERROR: {e} with sql: {sql}")
             sys.exit(1)
+        self.check_table(table_name)
+
+    def check_table(self, table_name):
+        # Migrate the table once per process before its first use, every method that reads or writes it calls this
+        if table_name in self.checked_tables:
+            return
+        with self.lock:
+            table_lock = self.table_locks.setdefault(table_name, threading.Lock())
+        with table_lock:
+            # Checked again under the lock, another thread may have migrated the table meanwhile
+            if table_name in self.checked_tables:
+                return
+            if self.migrate_mysql_table(table_name):
+                self.checked_tables.add(table_name)
+
+    def migrate_mysql_table(self, table_name):
+        # Migrate a table of the former (milvus_id TEXT, image_path TEXT) schema, which has no index.
+        # Return False if the table does not exist.
+        sql = "select data_type from information_schema.columns " \
+              "where table_schema = database() and table_name = %s and column_name = 'milvus_id';"
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute(sql, (table_name,))
+                result = cursor.fetchone()
+                if result is None:
+                    return False
+                if result[0].lower() == 'bigint':
+                    return True
+                sql = "alter table " + table_name + " modify milvus_id BIGINT NOT NULL, add primary key (milvus_id), " \
+                      "add key idx_image_path (image_path(255));"
+                cursor.execute(sql)
+            LOGGER.info(f"MYSQL migrate table: {table_name} with sql: {sql}")
+            return True
+        except Exception as e:
+            LOGGER.error(f"MYSQL ERROR: {e} with sql: {sql}")
+            sys.exit(1)
 
     def load_data_to_mysql(self, table_name, data):
         # Batch insert (Milvus_ids, img_path) to mysql
-        self.test_connection()
+        self.check_table(table_name)
         sql = "insert into " + table_name + " (milvus_id,image_path) values (%s,%s);"
         try:
-            self.cursor.executemany(sql, data)
-            self.conn.commit()
+            with self.get_cursor() as cursor:
+                cursor.executemany(sql, data)
+                cursor.connection.commit()
             LOGGER.debug(f"MYSQL loads data to table: {table_name} successfully")
         except Exception as e:
             LOGGER.error(f"MYSQL ERROR: {e} with sql: {sql}")
             sys.exit(1)
 
     def search_by_milvus_ids(self, ids, table_name):
-        # Get the img_path according to the milvus ids
-        self.test_connection()
-        str_ids = str(ids).replace('[', '').replace(']', '')
-        sql = "select image_path from " + table_name + " where milvus_id in (" + str_ids + ") order by field (milvus_id," + str_ids + ");"
+        # Get the img_path according to the milvus ids, in the order of the ids
+        ids = [int(i) for i in ids]
+        paths = self.get_paths_by_milvus_ids(ids, table_name)
+        return [paths[i] for i in ids if i in paths]
+
+    def get_paths_by_milvus_ids(self, ids, table_name):
+        # Get the {milvus_id: img_path} of the milvus ids with one query
+        self.check_table(table_name)
+        ids = list({int(i) for i in ids})
+        if not ids:
+            return {}
+        sql = "select milvus_id, image_path from " + table_name + " where milvus_id in (" + ",".join(["%s"] * len(ids)) + ");"
         try:
-            self.cursor.execute(sql)
-            results = self.cursor.fetchall()
-            results = [res[0] for res in results]
-            LOGGER.debug("MYSQL search by milvus id.")
-            return results
+            with self.get_cursor() as cursor:
+                cursor.execute(sql, ids)
+                # Keyed by int, also for a row read before its table was migrated
+                paths = {int(row[0]): row[1] for row in cursor.fetchall()}
+            LOGGER.debug("MYSQL search by milvus id.", extra={'throttle': 'mysql_search'})
+            return paths
         except Exception as e:
             LOGGER.error(f"MYSQL ERROR: {e} with sql: {sql}")
             sys.exit(1)
 
     def delete_table(self, table_name):
         # Delete mysql table if exists
-        self.test_connection()
         sql = "drop table if exists " + table_name + ";"
         try:
-            self.cursor.execute(sql)
+            with self.get_cursor() as cursor:
+                cursor.execute(sql)
+            self.checked_tables.discard(table_name)
             LOGGER.debug(f"MYSQL delete table:{table_name}")
         except Exception as e:
             LOGGER.error(f"MYSQL ERROR: {e} with sql: {sql}")
@@ -77,11 +166,12 @@ def delete_table(self, table_name):
 
     def delete_all_data(self, table_name):
         # Delete all the data in mysql table
-        self.test_connection()
+        self.check_table(table_name)
         sql = 'delete from ' + table_name + ';'
         try:
-            self.cursor.execute(sql)
-            self.conn.commit()
+            with self.get_cursor() as cursor:
+                cursor.execute(sql)
+                cursor.connection.commit()
             LOGGER.debug(f"MYSQL delete all data in table:{table_name}")
         except Exception as e:
             LOGGER.error(f"MYSQL ERROR: {e} with sql: {sql}")
@@ -89,11 +179,12 @@ def delete_all_data(self, table_name):
 
     def count_table(self, table_name):
         # Get the number of mysql table
-        self.test_connection()
+        self.check_table(table_name)
         sql = "select count(milvus_id) from " + table_name + ";"
         try:
-            self.cursor.execute(sql)
-            results = self.cursor.fetchall()
+            with self.get_cursor() as cursor:
+                cursor.execute(sql)
+                results = cursor.fetchall()
             LOGGER.debug(f"MYSQL count table:{table_name}")
             return results[0][0]
         except Exception as e:
@@ -102,47 +193,91 @@ def count_table(self, table_name):
 
     def delete_by_milvus_id(self, table_name, milvus_id):
         # Delete data by milvus_id from mysql table
-        self.test_connection()
-        sql = f"delete from {table_name} where milvus_id = '{milvus_id}';"
+        self.check_table(table_name)
+        sql = f"delete from {table_name} where milvus_id = %s;"
         try:
-            self.cursor.execute(sql)
-            self.conn.commit()
+            with self.get_cursor() as cursor:
+                cursor.execute(sql, (int(milvus_id),))
+                cursor.connection.commit()
             LOGGER.debug(f"MYSQL delete data with milvus_id:{milvus_id} from table:{table_name}")
             return True
         except Exception as e:
             LOGGER.error(f"MYSQL ERROR: {e} with sql: {sql}")
             return False
 
-    def get_all_data(self, table_name, page_num=1, page_size=10):
-        # Get data from mysql table with pagination
-        self.test_connection()
+    def delete_by_milvus_ids(self, table_name, ids, batch_size=1000):
+        # Delete data by milvus_ids from mysql table, batch_size ids per statement
+        self.check_table(table_name)
+        ids = [int(i) for i in ids]
         try:
-            # 首先获取总记录数
-            count_sql = f"select count(*) from {table_name};"
-            self.cursor.execute(count_sql)
-            total = self.cursor.fetchone()[0]
-            
-            # 计算偏移量
-            offset = (page_num - 1) * page_size
-            
-            # 获取分页数据
-            sql = f"select milvus_id, image_path from {table_name} limit {offset}, {page_size};"
-            self.cursor.execute(sql)
-            results = self.cursor.fetchall()
-            
+            with self.get_cursor() as cursor:
+                for start in range(0, len(ids), batch_size):
+                    batch = ids[start:start + batch_size]
+                    sql = f"delete from {table_name} where milvus_id in (" + ",".join(["%s"] * len(batch)) + ");"
+                    cursor.execute(sql, batch)
+                cursor.connection.commit()
+            LOGGER.debug(f"MYSQL delete {len(ids)} rows from table:{table_name}")
+            return True
+        except Exception as e:
+            LOGGER.error(f"MYSQL ERROR: {e}")
+            return False
+
+    def get_by_path_prefix(self, table_name, prefix):
+        # Get the (milvus_id, image_path) of the images under the path prefix, a range scan of idx_image_path
+        self.check_table(table_name)
+        pattern = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        sql = f"select milvus_id, image_path from {table_name} where image_path like %s;"
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute(sql, (pattern,))
+                results = cursor.fetchall()
+            LOGGER.debug(f"MYSQL get {len(results)} rows with prefix:{prefix} from table:{table_name}")
+            return list(results)
+        except Exception as e:
+            LOGGER.error(f"MYSQL ERROR: {e} with sql: {sql}")
+            sys.exit(1)
+
+    def get_all_data(self, table_name, page_num=1, page_size=10, after=None):
+        # Get data from mysql table with pagination, ordered by milvus_id.
+        # With after, the page starts right after that milvus_id, which is a primary key range scan
+        # instead of skipping the rows of the previous pages. The total is only counted for the
+        # page numbered requests, a cursor page returns None for total and total_pages.
+        self.check_table(table_name)
+        total = total_pages = None
+        try:
+            with self.get_cursor() as cursor:
+                # 首先获取总记录数
+                if after is None:
+                    count_sql = f"select count(*) from {table_name};"
+                    cursor.execute(count_sql)
+                    total = cursor.fetchone()[0]
+
+                # 获取分页数据
+                if after is not None:
+                    sql = f"select milvus_id, image_path from {table_name} where milvus_id > %s order by milvus_id limit %s;"
+                    cursor.execute(sql, (int(after), page_size))
+                else:
+                    # 计算偏移量
+                    offset = (page_num - 1) * page_size
+                    sql = f"select milvus_id, image_path from {table_name} order by milvus_id limit %s, %s;"
+                    cursor.execute(sql, (offset, page_size))
+                results = cursor.fetchall()
+
             # 将结果转换为字典列表
             data = [{"milvus_id": str(row[0]), "image_path": row[1]} for row in results]
-            
+
             # 计算总页数
-            total_pages = (total + page_size - 1) // page_size
-            
+            if total is not None:
+                total_pages = (total + page_size - 1) // page_size
+
             LOGGER.debug(f"MYSQL get data from table:{table_name} with pagination")
             return {
                 "total": total,
                 "total_pages": total_pages,
                 "current_page": page_num,
                 "page_size": page_size,
-                "data": data
+                "data": data,
+                "next_cursor": data[-1]["milvus_id"] if len(data) == page_size else None
             }
         except Exception as e:
             LOGGER.error(f"MYSQL ERROR: {e}")
@@ -152,11 +287,12 @@ def get_image_path_by_id(self, table_name: str, milvus_id: str) -> str:
         """
         通过 milvus_id 直接获取图片路径
         """
+        self.check_table(table_name)
         try:
-            self.test_connection()
             sql = f"SELECT image_path FROM {table_name} WHERE milvus_id = %s"
-            self.cursor.execute(sql, (milvus_id,))
-            result = self.cursor.fetchone()
+            with self.get_cursor() as cursor:
+                cursor.execute(sql, (milvus_id,))
+                result = cursor.fetchone()
             return result[0] if result else None
         except Exception as e:
             LOGGER.error(f"MYSQL ERROR: {e}")
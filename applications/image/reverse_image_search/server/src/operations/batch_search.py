@@ -0,0 +1,38 @@
+import sys
+from config import DEFAULT_TABLE, BATCH_SEARCH_SIZE
+from logs import LOGGER
+from milvus_helpers import MilvusHelper, CollectionRebuilding
+from mysql_helpers import MySQLHelper
+from encode import Resnet50
+
+
+# Search many images at once: the images are embedded in batches, searched with multi vector Milvus
+# searches, and the paths of all the results are fetched with one MySQL query.
+# Return one list of (path, distance) per image, None for the images that can not be decoded.
+def do_batch_search(table_name: str, imgs: list, top_k: int, model: Resnet50, milvus_client: MilvusHelper,
+                    mysql_cli: MySQLHelper, batch_size: int = BATCH_SEARCH_SIZE):
+    try:
+        if not table_name:
+            table_name = DEFAULT_TABLE
+        feats = model.resnet50_extract_list(imgs)
+        valid = [i for i, feat in enumerate(feats) if feat is not None]
+        in_milvus = 'image_path' in milvus_client.scalar_fields(table_name)
+        output_fields = ['image_path'] if in_milvus else None
+        hits = {}
+        for start in range(0, len(valid), batch_size):
+            batch = valid[start:start + batch_size]
+            res = milvus_client.search_vectors(table_name, [feats[i] for i in batch], top_k, output_fields)
+            hits.update(zip(batch, res))
+        if in_milvus:
+            paths = {x.id: x.entity.get('image_path') for i in valid for x in hits[i]}
+        else:
+            paths = mysql_cli.get_paths_by_milvus_ids([x.id for i in valid for x in hits[i]], table_name)
+        results = [None] * len(imgs)
+        for i in valid:
+            results[i] = [(paths[x.id], x.distance) for x in hits[i] if x.id in paths]
+        return results
+    except CollectionRebuilding:
+        raise
+    except Exception as e:
+        LOGGER.error(f"Error with batch search : {e}")
+        sys.exit(1)
@@ -0,0 +1,45 @@
+import os
+from logs import LOGGER
+from milvus_helpers import MilvusHelper
+from mysql_helpers import MySQLHelper
+from search_cache import SEARCH_CACHE
+from manifest import MANIFEST
+from dedup import DEDUP
+
+
+# Delete many images at once, by milvus ids and/or by image path prefix, with batched deletes to
+# Milvus and MySQL. Milvus compacts the collection once enough rows are deleted.
+def do_bulk_delete(table_name: str, milvus_ids: list, path_prefix: str, milvus_cli: MilvusHelper,
+                   mysql_cli: MySQLHelper, remove_files: bool = True):
+    if not table_name:
+        raise Exception("Table name is required!")
+    if not milvus_ids and not path_prefix:
+        raise Exception("Milvus ids or path prefix are required!")
+    try:
+        rows = {}
+        if milvus_ids:
+            rows.update(mysql_cli.get_paths_by_milvus_ids(milvus_ids, table_name))
+        if path_prefix:
+            rows.update(mysql_cli.get_by_path_prefix(table_name, path_prefix))
+        if not rows:
+            return 0
+        ids = list(rows)
+        status_milvus = milvus_cli.delete_entities_by_ids(table_name, ids)
+        status_mysql = mysql_cli.delete_by_milvus_ids(table_name, ids)
+        if not (status_milvus and status_mysql):
+            raise Exception("Failed to delete data from databases")
+        for image_path in rows.values():
+            MANIFEST.discard(table_name, image_path)
+        DEDUP.discard(table_name, ids)
+        SEARCH_CACHE.invalidate(table_name)
+    except Exception as e:
+        LOGGER.error(f"Error with bulk delete: {e}")
+        raise e
+    if remove_files:
+        for image_path in rows.values():
+            try:
+                os.remove(image_path)
+            except OSError as e:
+                LOGGER.warning(f"Failed to delete image file {image_path}: {e}")
+    LOGGER.info(f"Successfully deleted {len(rows)} images from table:{table_name}")
+    return len(rows)
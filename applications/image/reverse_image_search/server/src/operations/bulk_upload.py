@@ -0,0 +1,108 @@
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from urllib.request import urlopen
+from config import DEFAULT_TABLE, LOAD_FLUSH_SIZE, FETCH_WORKERS, FETCH_TIMEOUT
+from logs import LOGGER
+from milvus_helpers import MilvusHelper
+from mysql_helpers import MySQLHelper
+from encode import Resnet50
+from operations.load import extract_features, flush_chunk
+from manifest import MANIFEST
+from dedup import DEDUP
+
+
+def upload_to_path(filename, content, img_dir, taken=()):
+    # Name the file after the upload, a name that is taken gets a prefix of the content hash, and a counter if needed
+    name = os.path.basename(filename or '') or 'image.jpg'
+    prefix = hashlib.md5(content).hexdigest()[:8]
+    img_path = os.path.join(img_dir, name)
+    num = 0
+    while os.path.exists(img_path) or img_path in taken:
+        img_path = os.path.join(img_dir, f"{prefix}_{num}_{name}" if num else f"{prefix}_{name}")
+        num += 1
+    return img_path
+
+
+def fetch_url(url):
+    # Download one image, return None if it can not be fetched
+    try:
+        with urlopen(url, timeout=FETCH_TIMEOUT) as response:
+            return response.read()
+    except Exception as e:
+        LOGGER.error(f"Error with fetching image {url}: {e}")
+        return None
+
+
+def fetch_urls(urls, workers=FETCH_WORKERS):
+    # Download the urls with at most `workers` requests in flight, return the (file name, content) of the fetched ones
+    urls = list(dict.fromkeys(urls))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fetch') as pool:
+        return [(os.path.basename(urlparse(url).path), content)
+                for url, content in zip(urls, pool.map(fetch_url, urls)) if content is not None]
+
+
+def name_uploads(uploads, img_dir):
+    # Give every upload its own path, the same content twice is kept once. Return {img_path: content}.
+    contents = {}
+    digests = set()
+    for filename, content in uploads:
+        digest = hashlib.md5(content).hexdigest()
+        if digest in digests:
+            continue
+        digests.add(digest)
+        contents[upload_to_path(filename, content, img_dir, contents)] = content
+    return contents
+
+
+# Insert many uploaded images and urls at once: the urls are fetched concurrently, the copies are skipped
+# before anything is written, and the images are embedded in batches and written to Milvus and MySQL
+# one chunk at a time. uploads is a list of (file name, content).
+def do_bulk_upload(table_name: str, uploads: list, urls: list, img_dir: str, model: Resnet50,
+                   milvus_client: MilvusHelper, mysql_cli: MySQLHelper, flush_size: int = LOAD_FLUSH_SIZE,
+                   progress=None):
+    if not table_name:
+        table_name = DEFAULT_TABLE
+    uploads = list(uploads or [])
+    if urls:
+        fetched = fetch_urls(urls)
+        LOGGER.info(f"Fetched {len(fetched)} of {len(urls)} urls")
+        uploads.extend(fetched)
+    contents = name_uploads(uploads, img_dir)
+    if not milvus_client.has_collection(table_name):
+        milvus_client.create_collection(table_name)
+    mysql_cli.create_mysql_table(table_name)
+    img_paths = list(contents)
+    total = len(img_paths)
+    hashes = None
+    if DEDUP.enabled:
+        img_paths, hashes = DEDUP.filter(table_name, img_paths, contents=contents)
+    # Only the images to insert are saved, so the skipped copies leave no file behind
+    for img_path in img_paths:
+        with open(img_path, 'wb') as f:
+            f.write(contents[img_path])
+    contents.clear()
+    num = 0
+    vectors = []
+    paths = []
+    for feats, batch_paths, current in extract_features(img_paths, model):
+        vectors.extend(feats)
+        paths.extend(batch_paths)
+        if len(vectors) >= flush_size:
+            num += flush_chunk(table_name, vectors, paths, milvus_client, mysql_cli, MANIFEST, hashes)
+            vectors, paths = [], []
+            if progress:
+                progress(total - len(img_paths) + current, total)
+    if vectors:
+        num += flush_chunk(table_name, vectors, paths, milvus_client, mysql_cli, MANIFEST, hashes)
+    milvus_client.flush(table_name)
+    # A new collection is indexed once its first rows are flushed, so that the index is sized from them
+    if not milvus_client.has_index(table_name):
+        milvus_client.create_index(table_name)
+    else:
+        milvus_client.index_outdated(table_name)
+    if progress:
+        progress(total, total)
+    LOGGER.info(f"Bulk uploaded {num} of {total} images to table {table_name}")
+    return num
@@ -1,5 +1,8 @@
 import os
 from logs import LOGGER
+from search_cache import SEARCH_CACHE
+from manifest import MANIFEST
+from dedup import DEDUP
 
 def do_delete_by_id(table_name, milvus_id, milvus_cli, mysql_cli):
     try:
@@ -15,6 +18,9 @@ def do_delete_by_id(table_name, milvus_id, milvus_cli, mysql_cli):
         # 删除数据库记录
         status_mysql = mysql_cli.delete_by_milvus_id(table_name, milvus_id)
         status_milvus = milvus_cli.delete_entity_by_id(table_name, milvus_id)
+        MANIFEST.discard(table_name, image_path)
+        DEDUP.discard(table_name, [milvus_id])
+        SEARCH_CACHE.invalidate(table_name)
         
         # 删除图片文件
         if image_path and os.path.exists(image_path):
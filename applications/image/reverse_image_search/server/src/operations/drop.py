@@ -3,6 +3,9 @@
 from logs import LOGGER
 from milvus_helpers import MilvusHelper
 from mysql_helpers import MySQLHelper
+from search_cache import SEARCH_CACHE
+from manifest import MANIFEST
+from dedup import DEDUP
 
 
 def do_drop(table_name: str, milvus_cli: MilvusHelper, mysql_cli: MySQLHelper):
@@ -13,6 +16,9 @@ def do_drop(table_name: str, milvus_cli: MilvusHelper, mysql_cli: MySQLHelper):
             return f"Milvus doesn't have a collection named {table_name}"
         status = milvus_cli.delete_collection(table_name)
         mysql_cli.delete_table(table_name)
+        MANIFEST.clear_table(table_name)
+        DEDUP.clear_table(table_name)
+        SEARCH_CACHE.invalidate(table_name)
         return status
     except Exception as e:
         LOGGER.error(f"Error with drop table: {e}")
@@ -1,6 +1,6 @@
 from logs import LOGGER
 
-def do_get_all(table_name, mysql_cli, page_num=1, page_size=10):
+def do_get_all(table_name, mysql_cli, page_num=1, page_size=10, after=None):
     try:
         if not table_name:
             raise Exception("Table name is required!")
@@ -11,7 +11,7 @@ def do_get_all(table_name, mysql_cli, page_num=1, page_size=10):
         if page_size < 1:
             raise Exception("Page size must be greater than 0!")
             
-        data = mysql_cli.get_all_data(table_name, page_num, page_size)
+        data = mysql_cli.get_all_data(table_name, page_num, page_size, after)
         return data
     except Exception as e:
         LOGGER.error(f"Error with get all data: {e}")
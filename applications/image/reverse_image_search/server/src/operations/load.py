@@ -1,43 +1,42 @@
 import sys
 import os
 from diskcache import Cache
-from config import DEFAULT_TABLE
+from config import DEFAULT_TABLE, LOAD_BATCH_SIZE, LOAD_FLUSH_SIZE
 from logs import LOGGER
 from milvus_helpers import MilvusHelper
 from mysql_helpers import MySQLHelper
 from encode import Resnet50
+from search_cache import SEARCH_CACHE
+from manifest import LoadManifest, MANIFEST
+from dedup import DEDUP
 
 
 # Get the path to the image
 def get_imgs(path):
     pics = []
     for f in os.listdir(path):
-        if ((f.endswith(extension) for extension in
-             ['.png', '.jpg', '.jpeg', '.PNG', '.JPG', '.JPEG']) and not f.startswith('.DS_Store')):
+        if f.endswith(('.png', '.jpg', '.jpeg', '.PNG', '.JPG', '.JPEG')) and not f.startswith('.DS_Store'):
             pics.append(os.path.join(path, f))
     return pics
 
 
-# Get the vector of images
-def extract_features(img_dir, model):
+# Report the progress through the global diskcache keys
+def cache_progress(current, total):
+    cache = Cache('./tmp')
+    cache['current'] = current
+    cache['total'] = total
+
+
+# Get the vector of images batch by batch, together with the number of images processed so far
+def extract_features(img_list, model, batch_size=LOAD_BATCH_SIZE):
     try:
-        cache = Cache('./tmp')
-        feats = []
-        names = []
-        img_list = get_imgs(img_dir)
         total = len(img_list)
-        cache['total'] = total
-        for i, img_path in enumerate(img_list):
-            try:
-                norm_feat = model.resnet50_extract_feat(img_path)
-                feats.append(norm_feat)
-                names.append(img_path.encode())
-                cache['current'] = i + 1
-                LOGGER.info(f"Extracting feature from image No. {i + 1} , {total} images in total")
-            except Exception as e:
-                LOGGER.error(f"Error with extracting feature from image {e}")
-                continue
-        return feats, names
+        current = 0
+        for paths, feats in model.resnet50_extract_batches(img_list, batch_size):
+            current = min(current + batch_size, total)
+            LOGGER.info(f"Extracting feature from image No. {current} , {total} images in total",
+                        extra={'throttle': 'extract_features'})
+            yield feats, paths, current
     except Exception as e:
         LOGGER.error(f"Error with extracting feature from image {e}")
         sys.exit(1)
@@ -49,15 +48,69 @@ def format_data(ids, names):
     return data
 
 
-# Import vectors to Milvus and data to Mysql respectively
-def do_load(table_name: str, image_dir: str, model: Resnet50, milvus_client: MilvusHelper, mysql_cli: MySQLHelper):
+# Write one chunk of vectors to Milvus and the matching paths to MySQL, then checkpoint it in the manifest
+def flush_chunk(table_name, vectors, paths, milvus_client, mysql_cli, manifest=MANIFEST, hashes=None):
+    # Images modified since they were loaded replace their earlier rows
+    stale_ids = manifest.stale_ids(table_name, paths)
+    if stale_ids:
+        milvus_client.delete_entities_by_ids(table_name, stale_ids)
+        mysql_cli.delete_by_milvus_ids(table_name, stale_ids)
+    ids = milvus_client.insert(table_name, vectors, {"image_path": paths})
+    mysql_cli.load_data_to_mysql(table_name, format_data(ids, [path.encode() for path in paths]))
+    manifest.commit(table_name, paths, ids)
+    # Record the hashes of the images from the dedup filter, so that their later copies are skipped
+    if stale_ids:
+        DEDUP.discard(table_name, stale_ids)
+    if hashes:
+        DEDUP.add(table_name, [hashes.get(path) for path in paths], ids)
+    SEARCH_CACHE.invalidate(table_name)
+    return len(ids)
+
+
+# Import vectors to Milvus and data to Mysql chunk by chunk, so memory stays bounded by flush_size.
+# A rerun of an interrupted load only processes the images not committed yet.
+def do_load(table_name: str, image_dir: str, model: Resnet50, milvus_client: MilvusHelper, mysql_cli: MySQLHelper,
+            flush_size: int = LOAD_FLUSH_SIZE, manifest: LoadManifest = MANIFEST, progress=cache_progress):
     if not table_name:
         table_name = DEFAULT_TABLE
     if not milvus_client.has_collection(table_name):
         milvus_client.create_collection(table_name)
-        milvus_client.create_index(table_name)
-    vectors, names = extract_features(image_dir, model)
-    ids = milvus_client.insert(table_name, vectors)
+        # A manifest left behind by a dropped collection must not skip any image
+        manifest.clear_table(table_name)
+        DEDUP.clear_table(table_name)
     mysql_cli.create_mysql_table(table_name)
-    mysql_cli.load_data_to_mysql(table_name, format_data(ids, names))
-    return len(ids)
+    img_list = get_imgs(image_dir)
+    total = len(img_list)
+    img_list = [img_path for img_path in img_list if not manifest.is_committed(table_name, img_path)]
+    # Copies of images of the table or of the directory are skipped before they are embedded
+    hashes = None
+    if DEDUP.enabled:
+        # A modified image is not a copy of its own earlier version, which flush_chunk replaces
+        previous_ids = {img_path: manifest.previous_id(table_name, img_path) for img_path in img_list}
+        img_list, hashes = DEDUP.filter(table_name, img_list, previous_ids)
+    skipped = total - len(img_list)
+    if skipped:
+        LOGGER.info(f"Skip {skipped} images already loaded to table {table_name} or duplicated")
+    progress(skipped, total)
+    num = 0
+    vectors = []
+    paths = []
+    for feats, batch_paths, current in extract_features(img_list, model):
+        vectors.extend(feats)
+        paths.extend(batch_paths)
+        if len(vectors) >= flush_size:
+            num += flush_chunk(table_name, vectors, paths, milvus_client, mysql_cli, manifest, hashes)
+            vectors, paths = [], []
+            progress(skipped + current, total)
+            LOGGER.info(f"Flushed {num} vectors to table {table_name}")
+    if vectors:
+        num += flush_chunk(table_name, vectors, paths, milvus_client, mysql_cli, manifest, hashes)
+    # Seal the loaded data once, so that the count is accurate right after the load
+    milvus_client.flush(table_name)
+    # A new collection is indexed once its first rows are flushed, so that the index is sized from them
+    if not milvus_client.has_index(table_name):
+        milvus_client.create_index(table_name)
+    else:
+        milvus_client.index_outdated(table_name)
+    progress(total, total)
+    return num
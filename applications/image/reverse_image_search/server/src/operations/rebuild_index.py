@@ -0,0 +1,20 @@
+import sys
+from config import DEFAULT_TABLE
+from logs import LOGGER
+from milvus_helpers import MilvusHelper
+from search_cache import SEARCH_CACHE
+
+
+def do_rebuild_index(table_name: str, index_type: str, milvus_cli: MilvusHelper, progress=None):
+    # Rebuild the index of the table, as index_type or as configured for the table when it is None
+    if not table_name:
+        table_name = DEFAULT_TABLE
+    try:
+        if not milvus_cli.has_collection(table_name):
+            return f"Milvus doesn't have a collection named {table_name}"
+        index_type = milvus_cli.rebuild_index(table_name, index_type.upper() if index_type else None)
+        SEARCH_CACHE.invalidate(table_name)
+        return index_type
+    except Exception as e:
+        LOGGER.error(f"Error with rebuild index: {e}")
+        sys.exit(1)
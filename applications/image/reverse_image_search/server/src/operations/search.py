@@ -1,21 +1,39 @@
 import sys
 from config import DEFAULT_TABLE
 from logs import LOGGER
-from milvus_helpers import MilvusHelper
+from milvus_helpers import MilvusHelper, CollectionRebuilding
 from mysql_helpers import MySQLHelper
 from encode import Resnet50
+from search_cache import SEARCH_CACHE
 
 
-def do_search(table_name: str, img_path: str, top_k: int, model: Resnet50, milvus_client: MilvusHelper, mysql_cli: MySQLHelper):
+def do_search(table_name: str, img, top_k: int, model: Resnet50, milvus_client: MilvusHelper, mysql_cli: MySQLHelper,
+              img_hash: str = None):
     try:
         if not table_name:
             table_name = DEFAULT_TABLE
-        feat = model.resnet50_extract_feat(img_path)
-        vectors = milvus_client.search_vectors(table_name, [feat], top_k)
-        vids = [str(x.id) for x in vectors[0]]
-        paths = mysql_cli.search_by_milvus_ids(vids, table_name)
-        distances = [x.distance for x in vectors[0]]
+        # The embedding and the results are cached by the hash of the image content, when it is given
+        entry = SEARCH_CACHE.get_embedding(img_hash) if img_hash else None
+        if entry is None:
+            feat = model.resnet50_extract_feat(img)
+            entry = SEARCH_CACHE.set_embedding(img_hash, feat) if img_hash else (feat, SEARCH_CACHE.hash(feat.tobytes()))
+        feat, feat_hash = entry
+        key = SEARCH_CACHE.results_key(table_name, feat_hash, top_k)
+        results = SEARCH_CACHE.get_results(key)
+        if results is not None:
+            return results
+        if 'image_path' in milvus_client.scalar_fields(table_name):
+            hits = milvus_client.search_vector(table_name, feat, top_k, ['image_path'])
+            paths = [x.entity.get('image_path') for x in hits]
+        else:
+            hits = milvus_client.search_vector(table_name, feat, top_k)
+            vids = [str(x.id) for x in hits]
+            paths = mysql_cli.search_by_milvus_ids(vids, table_name)
+        distances = [x.distance for x in hits]
+        SEARCH_CACHE.set_results(key, (paths, distances))
         return paths, distances
+    except CollectionRebuilding:
+        raise
     except Exception as e:
         LOGGER.error(f"Error with search : {e}")
         sys.exit(1)
@@ -4,18 +4,40 @@
 from milvus_helpers import MilvusHelper
 from mysql_helpers import MySQLHelper
 from encode import Resnet50
+from search_cache import SEARCH_CACHE
+from manifest import MANIFEST
+from dedup import DEDUP
 
-def do_upload(table_name: str, img_path: str, model: Resnet50, milvus_client: MilvusHelper, mysql_cli: MySQLHelper):
+# With content, the image is saved to img_path only once it is known not to be a duplicate
+def do_upload(table_name: str, img_path: str, model: Resnet50, milvus_client: MilvusHelper, mysql_cli: MySQLHelper,
+              content: bytes = None):
     try:
         if not table_name:
             table_name = DEFAULT_TABLE
         if not milvus_client.has_collection(table_name):
             milvus_client.create_collection(table_name)
-            milvus_client.create_index(table_name)
+        # A copy of an image of the table is not inserted again, its milvus id is returned
+        hashes = DEDUP.hashes(img_path, content) if DEDUP.enabled else None
+        if hashes is not None:
+            milvus_id = DEDUP.find(table_name, hashes)
+            if milvus_id is not None:
+                LOGGER.info(f"Skip duplicate image {img_path} of milvus id {milvus_id} in table {table_name}")
+                return milvus_id
+        if content is not None:
+            with open(img_path, 'wb') as f:
+                f.write(content)
         feat = model.resnet50_extract_feat(img_path)
-        ids = milvus_client.insert(table_name, [feat])
+        ids = milvus_client.insert(table_name, [feat], {"image_path": [img_path]})
+        if not milvus_client.has_index(table_name):
+            # The first image of a new collection, it is indexed once the row is flushed
+            milvus_client.flush(table_name)
+            milvus_client.create_index(table_name)
         mysql_cli.create_mysql_table(table_name)
         mysql_cli.load_data_to_mysql(table_name, [(str(ids[0]), img_path.encode())])
+        MANIFEST.commit(table_name, [img_path], ids)
+        if hashes is not None:
+            DEDUP.add(table_name, [hashes], ids)
+        SEARCH_CACHE.invalidate(table_name)
         return ids[0]
     except Exception as e:
         LOGGER.error(f"Error with upload : {e}")
@@ -0,0 +1,89 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from config import EMBEDDING_CACHE_SIZE, RESULT_CACHE_SIZE, SEARCH_CACHE_TTL
+
+
+class LRUCache:
+    """
+    Thread safe LRU cache whose entries expire ttl seconds after they are set
+    """
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                return None
+            value, expire = entry
+            if expire < time.monotonic():
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + self.ttl)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+
+class SearchCache:
+    """
+    Two level cache of /img/search.
+
+    The first level maps the hash of the query image content to its embedding, the second maps
+    (table, generation, embedding hash, top_k) to the search results. Every write to a table bumps
+    its generation, so its cached results are never served again and age out of the LRU.
+    """
+    def __init__(self):
+        self.embeddings = LRUCache(EMBEDDING_CACHE_SIZE, SEARCH_CACHE_TTL)
+        self.results = LRUCache(RESULT_CACHE_SIZE, SEARCH_CACHE_TTL)
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def hash(content):
+        return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+    def get_embedding(self, img_hash):
+        # Return the (feat, feat_hash) of the image content
+        return self.embeddings.get(img_hash)
+
+    def set_embedding(self, img_hash, feat):
+        entry = (feat, self.hash(feat.tobytes()))
+        self.embeddings.set(img_hash, entry)
+        return entry
+
+    def results_key(self, table_name, feat_hash, top_k):
+        # Take the key before searching, so results computed across a write are stored under the old generation
+        return table_name, self.generations.get(table_name, 0), feat_hash, top_k
+
+    def get_results(self, key):
+        return self.results.get(key)
+
+    def set_results(self, key, results):
+        self.results.set(key, results)
+
+    def lookup(self, table_name, img_hash, top_k):
+        # Return the cached results of the image content, without embedding it
+        entry = self.get_embedding(img_hash)
+        if entry is None:
+            return None
+        return self.get_results(self.results_key(table_name, entry[1], top_k))
+
+    def invalidate(self, table_name):
+        with self.lock:
+            self.generations[table_name] = self.generations.get(table_name, 0) + 1
+
+
+SEARCH_CACHE = SearchCache()
@@ -1,7 +1,9 @@
+import time
 from fastapi.testclient import TestClient
 import gdown
 import zipfile
 from main import app
+from dedup import DEDUP
 
 client = TestClient(app)
 
@@ -12,6 +14,16 @@ def get_file():
     with zipfile.ZipFile('example_img.zip', 'r') as zip_ref:
         zip_ref.extractall('./')
 
+def wait_job(job_id, timeout=600):
+    # Poll the job until it is finished or failed
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f'/jobs/{job_id}').json()
+        if job['status'] in ['finished', 'failed']:
+            return job
+        time.sleep(1)
+    raise TimeoutError(f"Job {job_id} did not end in {timeout} seconds")
+
 def test_drop():
     response = client.post('/img/drop')
     assert response.status_code == 200
@@ -24,6 +36,45 @@ def test_load_img():
     )
     assert response.status_code == 200
 
+def test_job():
+    response = client.post(
+    '/img/load',
+    json={"Table": "test_table", "File": "./example_img"}
+    )
+    assert response.status_code == 200
+    job_id = response.json()['job_id']
+    response = client.get(f'/jobs/{job_id}')
+    assert response.status_code == 200
+    assert wait_job(job_id)['status'] == 'finished'
+
+def test_load_resume():
+    # A second load of the same directory skips the committed images
+    num = client.post('/img/count?table_name=test_table').json()
+    response = client.post(
+    '/img/load',
+    json={"Table": "test_table", "File": "./example_img"}
+    )
+    assert response.status_code == 200
+    job = wait_job(response.json()['job_id'])
+    assert job['status'] == 'finished'
+    assert job['msg'] == 0
+    assert client.post('/img/count?table_name=test_table').json() == num
+
+def test_get_all_pagination():
+    response = client.get('/img/all/test_table?size=5')
+    assert response.status_code == 200
+    page = response.json()
+    assert page['total'] == 20
+    ids = [int(row['milvus_id']) for row in page['data']]
+    while page['next_cursor'] is not None:
+        response = client.get(f"/img/all/test_table?size=5&after={page['next_cursor']}")
+        assert response.status_code == 200
+        page = response.json()
+        assert page['total'] is None
+        ids.extend(int(row['milvus_id']) for row in page['data'])
+    assert ids == sorted(set(ids))
+    assert len(ids) == 20
+
 def test_progress():
     response = client.get('/progress')
     assert response.status_code == 200
@@ -37,14 +88,63 @@ def test_get_img():
     response = client.get('/data?image_path=.%2Fexample_img%2Ftest.jpg')
     assert response.status_code == 200
 
+def test_get_img_cached():
+    response = client.get('/data?image_path=.%2Fexample_img%2Ftest.jpg&size=small')
+    assert response.status_code == 200
+    response = client.get('/data?image_path=.%2Fexample_img%2Ftest.jpg&size=small',
+                          headers={'If-None-Match': response.headers['etag']})
+    assert response.status_code == 304
+    response = client.get('/data?image_path=.%2Fexample_img%2Ftest.jpg', headers={'Range': 'bytes=0-99'})
+    assert response.status_code == 206
+    assert len(response.content) == 100
+
 def test_upload_img():
     _test_upload_file = './example_img/test.jpg'
     _files = {'image': open(_test_upload_file, 'rb')}
     response = client.post('/img/upload', files = _files)
     assert response.status_code == 200
 
+def test_upload_dedup():
+    # With dedup on, a copy of an image of the table is not inserted again and gets the id of the image
+    mode = DEDUP.mode
+    DEDUP.mode = 'exact'
+    try:
+        _test_upload_file = './example_img/test.jpg'
+        ids = []
+        for _ in range(2):
+            _files = {'image': open(_test_upload_file, 'rb')}
+            response = client.post('/img/upload?table_name=dedup_table', files = _files)
+            assert response.status_code == 200
+            ids.append(response.json())
+        assert ids[0] == ids[1]
+    finally:
+        DEDUP.mode = mode
+        client.post('/img/drop?table_name=dedup_table')
+
+def test_bulk_upload_img():
+    _test_upload_file = './example_img/test.jpg'
+    _files = [('images', open(_test_upload_file, 'rb')), ('images', open(_test_upload_file, 'rb'))]
+    response = client.post('/img/bulk_upload', files = _files)
+    assert response.status_code == 200
+    assert 'job_id' in response.json()
+
 def test_search():
     _test_upload_file = './example_img/test.jpg'
     _files = {'image': open(_test_upload_file, 'rb')}
     response = client.post('/img/search', files = _files)
     assert response.status_code == 200
+
+def test_batch_search():
+    _test_upload_file = './example_img/test.jpg'
+    _files = [('images', open(_test_upload_file, 'rb')), ('images', open(_test_upload_file, 'rb'))]
+    response = client.post('/img/batch_search', files = _files, data = {'table_name': 'test_table'})
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+
+def test_bulk_delete():
+    response = client.post(
+    '/img/bulk_delete',
+    json={"table_name": "test_table", "path_prefix": "./example_img/no_such_dir/"}
+    )
+    assert response.status_code == 200
+    assert response.json()['count'] == 0
@@ -0,0 +1,112 @@
+import os
+import shutil
+from fastapi import FastAPI, File, UploadFile, Query
+from starlette.middleware.cors import CORSMiddleware
+
+from config import UPLOAD_PATH, PRELOAD_COLLECTIONS, TOP_K
+from logs import LOGGER
+from milvus_helpers import MilvusHelper
+from mysql_helpers import MySQLHelper
+from encode import SentenceModel
+from operations.load import do_load, get_progress
+from operations.search import do_search, do_get_answer
+from operations.count import do_count
+from operations.drop import do_drop
+
+app = FastAPI()
+origins = ["*"]
+app.add_middleware(
+    CORSMiddleware,
+
+    allow_origins=origins,
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+
+)
+
+MODEL = SentenceModel()
+MILVUS_CLI = MilvusHelper()
+MYSQL_CLI = MySQLHelper()
+
+# Mkdir '/tmp/qa-data'
+if not os.path.exists(UPLOAD_PATH):
+    os.makedirs(UPLOAD_PATH)
+
+
+@app.on_event("startup")
+def warm_up():
+    # Load the collections before serving, so that the first searches do not pay for it
+    if PRELOAD_COLLECTIONS == '*':
+        MILVUS_CLI.preload()
+    elif PRELOAD_COLLECTIONS:
+        MILVUS_CLI.preload(PRELOAD_COLLECTIONS.split(','))
+
+
+@app.post('/qa/load_data')
+def do_load_api(file: UploadFile = File(...), table_name: str = None):
+    # A sync handler runs in the threadpool, so /qa/progress is served while the file is loaded
+    try:
+        fname_path = os.path.join(UPLOAD_PATH, file.filename)
+        with open(fname_path, 'wb') as f:
+            shutil.copyfileobj(file.file, f)
+        total_num = do_load(table_name, fname_path, MODEL, MILVUS_CLI, MYSQL_CLI)
+        LOGGER.info(f"Successfully loaded data, total count: {total_num}")
+        return {'status': True, 'msg': f"Successfully loaded data: {total_num}"}, 200
+    except Exception as e:
+        LOGGER.error(e)
+        return {'status': False, 'msg': e}, 400
+
+
+@app.get('/qa/progress')
+async def do_progress_api(table_name: str = None):
+    # Get the progress of the running or last load of the table
+    return get_progress(table_name)
+
+
+@app.get('/qa/search')
+async def do_get_question_api(question: str, table_name: str = None, top_k: int = Query(TOP_K, ge=1, le=1000),
+                              offset: int = Query(0, ge=0, le=15000), threshold: float = None):
+    # top_k hits after the first offset hits, threshold is the min similarity with IP and the max distance with L2
+    try:
+        # The answers are returned inline, so the client does not need to call /qa/answer for every question
+        results = do_search(table_name, question, MODEL, MILVUS_CLI, MYSQL_CLI, top_k, offset, threshold)
+        LOGGER.info("Successfully searched similar questions!")
+        return {'status': True, 'msg': [res["question"] for res in results], 'results': results}, 200
+    except Exception as e:
+        LOGGER.error(e)
+        return {'status': False, 'msg': e}, 400
+
+
+@app.get('/qa/answer')
+async def do_get_answer_api(question: str = None, table_name: str = None, milvus_id: int = None):
+    try:
+        if question is None and milvus_id is None:
+            return {'status': False, 'msg': 'Question or milvus_id is required'}
+        results = do_get_answer(table_name, question, MYSQL_CLI, milvus_id)
+        return {'status': True, 'msg': results}
+    except Exception as e:
+        LOGGER.error(e)
+        return {'status': False, 'msg': e}
+
+
+@app.post('/qa/count')
+async def count_images(table_name: str = None):
+    try:
+        num = do_count(table_name, MILVUS_CLI)
+        LOGGER.info("Successfully count the number of questions!")
+        return num
+    except Exception as e:
+        LOGGER.error(e)
+        return {'status': False, 'msg': e}, 400
+
+
+@app.post('/qa/drop')
+async def drop_tables(table_name: str = None):
+    try:
+        status = do_drop(table_name, MILVUS_CLI, MYSQL_CLI)
+        LOGGER.info("Successfully drop tables in Milvus and MySQL!")
+        return {'status': True, 'msg': status}
+    except Exception as e:
+        LOGGER.error(e)
+        return {'status': False, 'msg': e}, 400
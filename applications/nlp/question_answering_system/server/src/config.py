@@ -8,6 +8,14 @@
 METRIC_TYPE = os.getenv("METRIC_TYPE", "IP")
 DEFAULT_TABLE = os.getenv("DEFAULT_TABLE", "qa_search")
 TOP_K = int(os.getenv("TOP_K", "10"))
+# Collections loaded into memory at startup, comma separated, "*" for all of them and "" for none
+PRELOAD_COLLECTIONS = os.getenv("PRELOAD_COLLECTIONS", "*")
+# Seconds a collection count may be served from cache
+COUNT_MAX_STALENESS = float(os.getenv("COUNT_MAX_STALENESS", "5"))
+# Where search gets the questions from: "mysql", or "milvus" to keep the questions and answers in VARCHAR fields
+# of new collections and return them with the search results, MySQL is then only a mirror
+STORAGE_MODE = os.getenv("STORAGE_MODE", "mysql")
+TEXT_MAX_LENGTH = int(os.getenv("TEXT_MAX_LENGTH", "65535"))
 
 ############### MySQL Configuration ###############
 MYSQL_HOST = os.getenv("MYSQL_HOST", "127.0.0.1")
@@ -15,9 +23,31 @@
 MYSQL_USER = os.getenv("MYSQL_USER", "root")
 MYSQL_PWD = os.getenv("MYSQL_PWD", "123456")
 MYSQL_DB = os.getenv("MYSQL_DB", "mysql")
+MYSQL_POOL_SIZE = int(os.getenv("MYSQL_POOL_SIZE", "8"))
+# Seconds a pooled connection may stay idle before it is pinged on borrow
+MYSQL_PING_INTERVAL = float(os.getenv("MYSQL_PING_INTERVAL", "30"))
+
+############### Encode Configuration ###############
+MODEL_NAME = os.getenv("MODEL_NAME", "all-MiniLM-L12-v2")
+# Sentences per forward pass, they are sorted by length first to limit the padding
+ENCODE_BATCH_SIZE = int(os.getenv("ENCODE_BATCH_SIZE", "64"))
+# Processes encoding the batches of a load, each loads its own model, 0 encodes in the server process
+ENCODE_PROCESSES = int(os.getenv("ENCODE_PROCESSES", "0"))
+
+############### Search Cache Configuration ###############
+# Number of /qa/search results cached, 0 disables the cache
+QA_CACHE_SIZE = int(os.getenv("QA_CACHE_SIZE", "1024"))
+# Min cosine similarity of a question to a cached question to reuse its results, 0 only reuses the same text
+QA_CACHE_THRESHOLD = float(os.getenv("QA_CACHE_THRESHOLD", "0.95"))
+
+############### Load Configuration ###############
+# Rows of the csv read, encoded and inserted at a time by /qa/load_data
+LOAD_CHUNK_SIZE = int(os.getenv("LOAD_CHUNK_SIZE", "10000"))
 
 ############### Data Path ###############
 UPLOAD_PATH = os.getenv("UPLOAD_PATH", "tmp/qa-data")
 
 ############### Number of log files ###############
 LOGS_NUM = int(os.getenv("logs_num", "0"))
+# Min seconds between two records of the same throttled log, such as the per batch progress of a load
+LOG_THROTTLE_SECONDS = float(os.getenv("LOG_THROTTLE_SECONDS", "1"))
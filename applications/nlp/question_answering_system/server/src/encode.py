@@ -1,24 +1,67 @@
-from towhee import ops, pipe
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from towhee import ops
+from config import MODEL_NAME, ENCODE_BATCH_SIZE, ENCODE_PROCESSES
+
+# The model of a worker process of the encode pool
+_WORKER_MODEL = None
+
+
+def _init_worker():
+    global _WORKER_MODEL
+    _WORKER_MODEL = SentenceModel(processes=0)
+
+
+def _encode_in_worker(sentences):
+    return _WORKER_MODEL.encode_batch(sentences)
 
 
 class SentenceModel:
     """
     SentenceModel
+
+    Sentences are sorted by length and encoded batch_size at a time, so every forward pass
+    pads its sentences to a similar length. With processes > 0, the batches of large inputs
+    are spread over a pool of processes, each with its own copy of the model.
     """
 
-    def __init__(self):
-        self.sentence_embedding_pipe = (
-            pipe.input('sentence')
-                .map('sentence', 'embedding', ops.sentence_embedding.sbert(model_name='all-MiniLM-L12-v2'))
-                .map('embedding', 'embedding', ops.towhee.np_normalize())
-                .output('embedding')
-            )
+    def __init__(self, batch_size=ENCODE_BATCH_SIZE, processes=ENCODE_PROCESSES):
+        # Use the sbert operator directly, so that it can encode a list of sentences in one forward pass
+        self.sbert = ops.sentence_embedding.sbert(model_name=MODEL_NAME).get_op()
+        self.batch_size = batch_size
+        self.processes = processes
+        self.pool = None
+
+    @staticmethod
+    def normalize(feat):
+        feat = np.asarray(feat, dtype=np.float32)
+        return feat / np.linalg.norm(feat)
+
+    def encode_batch(self, sentences):
+        # Encode a list of sentences with one forward pass
+        return [self.normalize(feat) for feat in self.sbert(list(sentences))]
+
+    def get_pool(self):
+        # Start the processes on the first large input, spawned so that they do not inherit the model threads
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker)
+        return self.pool
 
     def sentence_encode(self, data_list):
-        res_list = []
-        for data in data_list:
-            res = self.sentence_embedding_pipe(data)
-            res_list.append(res.get()[0])
+        data_list = [str(data) for data in data_list]
+        order = sorted(range(len(data_list)), key=lambda i: len(data_list[i]))
+        batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        sentences = [[data_list[i] for i in batch] for batch in batches]
+        if self.processes > 0 and len(batches) > 1:
+            feats = self.get_pool().map(_encode_in_worker, sentences)
+        else:
+            feats = map(self.encode_batch, sentences)
+        res_list = [None] * len(data_list)
+        for batch, batch_feats in zip(batches, feats):
+            for i, feat in zip(batch, batch_feats):
+                res_list[i] = feat
         return res_list
 
 
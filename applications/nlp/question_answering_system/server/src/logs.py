@@ -1,9 +1,14 @@
 import os
 import re
+import time
+import atexit
 import datetime
 import logging
+import threading
 import sys
-from config import LOGS_NUM
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from config import LOGS_NUM, LOG_THROTTLE_SECONDS
 
 try:
     import codecs
@@ -23,7 +28,9 @@ def __init__(self, filename, when='D', backupCount=0, encoding=None, delay=False
         self.prefix = filename
         self.backupCount = backupCount
         self.when = when.upper()
-        self.extMath = r"^\d{4}-\d{2}-\d{2}"
+        self.extMath = re.compile(r"^\d{4}-\d{2}-\d{2}")
+        # The date based filename is only recomputed when the second changes
+        self.lastCheck = int(time.time())
 
         self.when_dict = {
             'S': "%Y-%m-%d-%H-%M-%S",
@@ -56,6 +63,10 @@ def __init__(self, filename, when='D', backupCount=0, encoding=None, delay=False
         logging.FileHandler.__init__(self, self.filePath, 'a+', encoding, delay)
 
     def shouldChangeFileToWrite(self):
+        now = int(time.time())
+        if now == self.lastCheck:
+            return False
+        self.lastCheck = now
         _filePath = datetime.datetime.now().strftime(self.filefmt)
         if _filePath != self.filePath:
             self.filePath = _filePath
@@ -82,7 +93,7 @@ def getFilesToDelete(self):
         for file_name in file_names:
             if file_name[:len(prefix)] == prefix:
                 suffix = file_name[len(prefix):-4]
-                if re.compile(self.extMath).match(suffix):
+                if self.extMath.match(suffix):
                     result.append(os.path.join(dir_name, file_name))
         result.sort()
 
@@ -103,6 +114,29 @@ def emit(self, record):
             self.handleError(record)
 
 
+class ThrottleFilter(logging.Filter):
+    """
+    Drop the records logged with extra={'throttle': key} when a record of the same key
+    passed less than `interval` seconds ago, for logs written per item or per request.
+    """
+    def __init__(self, interval=LOG_THROTTLE_SECONDS):
+        super().__init__()
+        self.interval = interval
+        self.last = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, 'throttle', None)
+        if key is None:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last.get(key, -self.interval) < self.interval:
+                return False
+            self.last[key] = now
+        return True
+
+
 def write_log():
     logger = logging.getLogger()
     logger.setLevel(logging.DEBUG)
@@ -120,8 +154,15 @@ def write_log():
     file_handler.setFormatter(fmt)
     file_handler.doChangeFile()
 
-    logger.addHandler(stream_handler)
-    logger.addHandler(file_handler)
+    # The calling threads only put the records on a queue, a background listener writes them to the handlers
+    log_queue = SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(ThrottleFilter())
+    listener = QueueListener(log_queue, stream_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger.addHandler(queue_handler)
 
     return logger
 
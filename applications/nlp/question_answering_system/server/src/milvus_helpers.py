@@ -1,5 +1,8 @@
 import sys
-from config import MILVUS_HOST, MILVUS_PORT, VECTOR_DIMENSION, METRIC_TYPE
+import time
+import threading
+from config import MILVUS_HOST, MILVUS_PORT, VECTOR_DIMENSION, METRIC_TYPE, COUNT_MAX_STALENESS, STORAGE_MODE, \
+    TEXT_MAX_LENGTH
 from pymilvus import connections, FieldSchema, CollectionSchema, DataType, Collection, utility
 from logs import LOGGER
 
@@ -10,20 +13,65 @@ class MilvusHelper:
     """
     def __init__(self):
         try:
-            self.collection = None
+            # Collection handles are cached per collection, and the collections loaded into memory are tracked,
+            # so the search path goes straight to collection.search
+            self.collections = {}
+            self.loaded = set()
+            self.lock = threading.Lock()
+            # collection name -> (num, time), served by count for up to COUNT_MAX_STALENESS seconds
+            self.counts = {}
             connections.connect(host=MILVUS_HOST, port=MILVUS_PORT)
             LOGGER.debug(f"Successfully connect to Milvus with HOST: {MILVUS_HOST} and PORT: {MILVUS_PORT}")
         except Exception as e:
             LOGGER.error(f"Failed to connect Milvus: {e}")
             sys.exit(1)
 
-    def set_collection(self, collection_name):
+    def get_collection(self, collection_name):
+        # Return the cached collection handle
+        collection = self.collections.get(collection_name)
+        if collection is not None:
+            return collection
         try:
-            self.collection = Collection(name=collection_name)
+            collection = Collection(name=collection_name)
+            self.collections[collection_name] = collection
+            return collection
         except Exception as e:
             LOGGER.error(f"Failed to set collection in Milvus: {e}")
             sys.exit(1)
 
+    def load_collection(self, collection_name):
+        # Load the collection into memory once
+        if collection_name in self.loaded:
+            return
+        with self.lock:
+            if collection_name in self.loaded:
+                return
+            try:
+                self.get_collection(collection_name).load()
+                self.loaded.add(collection_name)
+                LOGGER.debug(f"Successfully load collection: {collection_name}")
+            except Exception as e:
+                LOGGER.error(f"Failed to load collection in Milvus: {e}")
+                sys.exit(1)
+
+    def preload(self, collection_names=None):
+        # Warm up the handles and load the collections before serving searches, all of them by default
+        try:
+            if collection_names is None:
+                collection_names = utility.list_collections()
+            for collection_name in collection_names:
+                if utility.has_collection(collection_name):
+                    self.load_collection(collection_name)
+            LOGGER.info(f"Successfully preload collections: {collection_names}")
+        except Exception as e:
+            LOGGER.error(f"Failed to preload collections in Milvus: {e}")
+            sys.exit(1)
+
+    def forget_collection(self, collection_name):
+        self.collections.pop(collection_name, None)
+        self.loaded.discard(collection_name)
+        self.counts.pop(collection_name, None)
+
     def has_collection(self, collection_name):
         # Return if Milvus has the collection
         try:
@@ -38,20 +86,34 @@ def create_collection(self, collection_name):
             field1 = FieldSchema(name="id", dtype=DataType.INT64, descrition="int64", is_primary=True, auto_id=True)
             field2 = FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, descrition="float vector",
                                     dim=VECTOR_DIMENSION, is_primary=False)
-            schema = CollectionSchema(fields=[field1, field2], description="collection description")
-            self.collection = Collection(name=collection_name, schema=schema)
+            fields = [field1, field2]
+            if STORAGE_MODE == 'milvus':
+                # Keep the question and answer in the collection, so that search returns them without a MySQL lookup
+                fields.append(FieldSchema(name="question", dtype=DataType.VARCHAR, description="question",
+                                          max_length=TEXT_MAX_LENGTH))
+                fields.append(FieldSchema(name="answer", dtype=DataType.VARCHAR, description="answer",
+                                          max_length=TEXT_MAX_LENGTH))
+            schema = CollectionSchema(fields=fields, description="collection description")
+            self.collections[collection_name] = Collection(name=collection_name, schema=schema)
             LOGGER.debug(f"Create Milvus collection: {collection_name}")
             return "OK"
         except Exception as e:
             LOGGER.error(f"Failed create collection in Milvus: {e}")
             sys.exit(1)
 
-    def insert(self, collection_name, vectors):
-        # Batch insert vectors to milvus collection
+    def scalar_fields(self, collection_name):
+        # Get the names of the VARCHAR fields stored in the collection
+        collection = self.get_collection(collection_name)
+        return [field.name for field in collection.schema.fields if field.dtype == DataType.VARCHAR]
+
+    def insert(self, collection_name, vectors, scalars=None):
+        # Batch insert vectors to milvus collection, with the values of its scalar fields by field name
         try:
-            self.set_collection(collection_name)
+            collection = self.get_collection(collection_name)
             data = [vectors]
-            mr = self.collection.insert(data)
+            for field_name in self.scalar_fields(collection_name):
+                data.append(scalars[field_name])
+            mr = collection.insert(data)
             ids = mr.primary_keys
             LOGGER.debug(
                     f"Insert vectors to Milvus in collection: {collection_name} with {len(vectors)} rows")
@@ -63,9 +125,9 @@ def insert(self, collection_name, vectors):
     def create_index(self, collection_name):
         # Create IVF_FLAT index on milvus collection
         try:
-            self.set_collection(collection_name)
+            collection = self.get_collection(collection_name)
             default_index = {"metric_type": METRIC_TYPE, "index_type": "IVF_FLAT", "params": {"nlist": 2048}}
-            status = self.collection.create_index(field_name="embedding", index_params=default_index)
+            status = collection.create_index(field_name="embedding", index_params=default_index)
             if not status.code:
                 LOGGER.debug(
                     f"Successfully create index in collection:{collection_name} with param:{default_index}")
@@ -79,35 +141,54 @@ def create_index(self, collection_name):
     def delete_collection(self, collection_name):
         # Delete Milvus collection
         try:
-            self.set_collection(collection_name)
-            self.collection.drop()
+            collection = self.get_collection(collection_name)
+            collection.drop()
+            self.forget_collection(collection_name)
             LOGGER.debug("Successfully drop collection!")
             return "ok"
         except Exception as e:
             LOGGER.error(f"Failed to drop collection: {e}")
             sys.exit(1)
 
-    def search_vectors(self, collection_name, vectors, top_k):
-        # Search vector in milvus collection
+    def search_vectors(self, collection_name, vectors, top_k, output_fields=None, offset=0):
+        # Search vector in milvus collection, skipping the first offset hits
         try:
-            self.set_collection(collection_name)
-            self.collection.load()
-            search_params = {"metric_type": METRIC_TYPE, "params": {"nprobe": 16}}
-            res = self.collection.search(vectors, anns_field="embedding", param=search_params, limit=top_k)
-            LOGGER.debug(f"Successfully search in collection: {res}")
+            self.load_collection(collection_name)
+            collection = self.get_collection(collection_name)
+            search_params = {"metric_type": METRIC_TYPE, "params": {"nprobe": 16}, "offset": offset}
+            res = collection.search(vectors, anns_field="embedding", param=search_params, limit=top_k,
+                                    output_fields=output_fields)
+            LOGGER.debug(f"Successfully search {len(vectors)} vectors in collection: {collection_name}",
+                         extra={'throttle': 'milvus_search'})
             return res
         except Exception as e:
             LOGGER.error(f"Failed to search vectors in Milvus: {e}")
             sys.exit(1)
 
-    def count(self, collection_name):
-        # Get the number of milvus collection
+    def count(self, collection_name, max_staleness=COUNT_MAX_STALENESS):
+        # Get the number of milvus collection from its row count statistics, without forcing a flush.
+        # Rows still in growing segments are counted once Milvus seals them, and the result is cached
+        # for max_staleness seconds.
         try:
-            self.set_collection(collection_name)
-            self.collection.flush()
-            num = self.collection.num_entities
+            cached = self.counts.get(collection_name)
+            if cached is not None and time.monotonic() - cached[1] < max_staleness:
+                return cached[0]
+            collection = self.get_collection(collection_name)
+            num = collection.num_entities
+            self.counts[collection_name] = (num, time.monotonic())
             LOGGER.debug(f"Successfully get the num:{num} of the collection:{collection_name}")
             return num
         except Exception as e:
             LOGGER.error(f"Failed to count vectors in Milvus: {e}")
-            sys.exit(1)
\ No newline at end of file
+            sys.exit(1)
+
+    def flush(self, collection_name):
+        # Seal the growing segments of the collection, only called at the end of a bulk load
+        try:
+            collection = self.get_collection(collection_name)
+            collection.flush()
+            self.counts.pop(collection_name, None)
+            LOGGER.debug(f"Successfully flush collection:{collection_name}")
+        except Exception as e:
+            LOGGER.error(f"Failed to flush collection in Milvus: {e}")
+            sys.exit(1)
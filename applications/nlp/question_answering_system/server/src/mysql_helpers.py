@@ -1,91 +1,191 @@
 import pymysql
 import sys
-from config import MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PWD, MYSQL_DB
+import time
+import queue
+import threading
+import hashlib
+from contextlib import contextmanager
+from config import MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PWD, MYSQL_DB, MYSQL_POOL_SIZE, MYSQL_PING_INTERVAL
 from logs import LOGGER
 
 
 class MySQLHelper():
     """
-    Say something about the ExampleCalass...
+    MySQL Helper
 
-    Args:
-        args_0 (`type`):
-        ...
+    Keeps a bounded pool of connections, every call borrows one and uses its own cursor.
+    A connection is health checked when it is borrowed after being idle for more than
+    MYSQL_PING_INTERVAL seconds.
     """
 
-    def __init__(self):
-        self.conn = pymysql.connect(host=MYSQL_HOST, user=MYSQL_USER, port=MYSQL_PORT, password=MYSQL_PWD,
-                                    database=MYSQL_DB,
-                                    local_infile=True)
-        self.cursor = self.conn.cursor()
+    def __init__(self, pool_size=MYSQL_POOL_SIZE):
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+        # Connect once eagerly to fail fast, the other connections are opened on demand
+        self.pool.put((self.connect(), time.monotonic()))
+        for _ in range(pool_size - 1):
+            self.pool.put((None, 0))
+        # Tables whose schema was checked, and migrated if needed, by this process
+        self.checked_tables = set()
+        # table name -> lock, so that concurrent first uses of a table do not migrate it twice
+        self.table_locks = {}
+        self.lock = threading.Lock()
 
-    def test_connection(self):
+    @staticmethod
+    def connect():
+        return pymysql.connect(host=MYSQL_HOST, user=MYSQL_USER, port=MYSQL_PORT, password=MYSQL_PWD,
+                               database=MYSQL_DB, local_infile=True)
+
+    @contextmanager
+    def get_cursor(self):
+        # Borrow a connection from the pool and yield a new cursor on it
+        conn, last_used = self.pool.get()
+        try:
+            if conn is None:
+                conn = self.connect()
+            elif time.monotonic() - last_used > MYSQL_PING_INTERVAL:
+                conn.ping(reconnect=True)
+            with conn.cursor() as cursor:
+                yield cursor
+            # End the transaction, so that a pooled connection does not keep an old REPEATABLE READ snapshot
+            conn.commit()
+        except Exception:
+            # A broken connection is closed and reopened on a later borrow
+            if conn is not None:
+                try:
+                    conn.rollback()
+                except Exception:
+                    self.close(conn)
+                    conn = None
+            raise
+        finally:
+            self.pool.put((conn, time.monotonic()))
+
+    @staticmethod
+    def close(conn):
         try:
-            self.conn.ping()
+            conn.close()
         except Exception:
-            self.conn = pymysql.connect(host=MYSQL_HOST, user=MYSQL_USER, port=MYSQL_PORT, password=MYSQL_PWD,
-                                    database=MYSQL_DB,local_infile=True)
-            self.cursor = self.conn.cursor()
+            pass
+
+    @staticmethod
+    def question_hash(question):
+        # Hex md5 of the utf-8 question, computed in Python so that it does not depend on the column charset
+        return hashlib.md5(str(question).encode('utf-8')).hexdigest()
 
     def create_mysql_table(self, table_name):
-        # Create mysql table if not exists
-        self.test_connection()
-        sql = "create table if not exists " + table_name + " (milvus_id TEXT, question TEXT, answer TEXT);"
+        # Create mysql table if not exists, milvus_id is the primary key and the md5 of the question is indexed
+        if table_name in self.checked_tables:
+            return
+        sql = "create table if not exists " + table_name + \
+              " (milvus_id BIGINT NOT NULL PRIMARY KEY, question TEXT, answer TEXT, question_hash CHAR(32)," \
+              " KEY idx_question_hash (question_hash));"
         try:
-            self.cursor.execute(sql)
+            with self.get_cursor() as cursor:
+                cursor.execute(sql)
             LOGGER.debug(f"MYSQL create table: {table_name} with sql: {sql}")
         except Exception as e:
             LOGGER.error(f"MYSQL ERROR: {e} with sql: {sql}")
             sys.exit(1)
+        self.check_table(table_name)
+
+    def check_table(self, table_name):
+        # Migrate the table once per process before its first use, every method that reads or writes it calls this
+        if table_name in self.checked_tables:
+            return
+        with self.lock:
+            table_lock = self.table_locks.setdefault(table_name, threading.Lock())
+        with table_lock:
+            # Checked again under the lock, another thread may have migrated the table meanwhile
+            if table_name in self.checked_tables:
+                return
+            if self.migrate_mysql_table(table_name):
+                self.checked_tables.add(table_name)
+
+    def migrate_mysql_table(self, table_name):
+        # Migrate a table of the former (milvus_id TEXT, question TEXT, answer TEXT) schema, which has no index.
+        # Return False if the table does not exist.
+        sql = "select column_name from information_schema.columns " \
+              "where table_schema = database() and table_name = %s;"
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute(sql, (table_name,))
+                columns = {row[0].lower() for row in cursor.fetchall()}
+                if not columns:
+                    return False
+                if 'question_hash' in columns:
+                    return True
+                sql = "alter table " + table_name + " modify milvus_id BIGINT NOT NULL, add primary key (milvus_id), " \
+                      "add question_hash CHAR(32), add key idx_question_hash (question_hash);"
+                cursor.execute(sql)
+                sql = "select milvus_id, question from " + table_name + ";"
+                cursor.execute(sql)
+                data = [(self.question_hash(question), milvus_id) for milvus_id, question in cursor.fetchall()]
+                sql = "update " + table_name + " set question_hash = %s where milvus_id = %s;"
+                cursor.executemany(sql, data)
+                cursor.connection.commit()
+            LOGGER.info(f"MYSQL migrate table: {table_name}, filled the question hash of {len(data)} rows")
+            return True
+        except Exception as e:
+            LOGGER.error(f"MYSQL ERROR: {e} with sql: {sql}")
+            sys.exit(1)
 
     def load_data_to_mysql(self, table_name, data):
-        # Batch insert (Milvus_ids, img_path) to mysql
-        self.test_connection()
-        sql = "insert into " + table_name + " (milvus_id,question,answer) values (%s,%s,%s);"
-        self.cursor.execute('SET character_set_connection=utf8;')
+        # Batch insert (milvus_id, question, answer) to mysql, with the hash of the question
+        self.check_table(table_name)
+        sql = "insert into " + table_name + " (milvus_id,question,answer,question_hash) values (%s,%s,%s,%s);"
+        data = [(milvus_id, question, answer, self.question_hash(question)) for milvus_id, question, answer in data]
         try:
-            self.cursor.executemany(sql, data)
-            self.conn.commit()
+            with self.get_cursor() as cursor:
+                cursor.execute('SET character_set_connection=utf8;')
+                cursor.executemany(sql, data)
+                cursor.connection.commit()
             LOGGER.debug(f"MYSQL loads data to table: {table_name} successfully")
         except Exception as e:
             LOGGER.error(f"MYSQL ERROR: {e} with sql: {sql}")
             sys.exit(1)
 
-    def search_by_milvus_ids(self, ids, table_name):
-        # Get the img_path according to the milvus ids
-        self.test_connection()
-        str_ids = str(ids).replace('[', '').replace(']', '')
-        sql = "select question from " + table_name + " where milvus_id in (" + str_ids + ") order by field (milvus_id," + str_ids + ");"
+    def get_by_milvus_ids(self, ids, table_name):
+        # Get the {milvus_id: (question, answer)} of the milvus ids with one primary key lookup
+        self.check_table(table_name)
+        ids = list({int(i) for i in ids})
+        if not ids:
+            return {}
+        sql = "select milvus_id, question, answer from " + table_name + \
+              " where milvus_id in (" + ",".join(["%s"] * len(ids)) + ");"
         try:
-            self.cursor.execute(sql)
-            results = self.cursor.fetchall()
-            results = [res[0] for res in results]
-            LOGGER.debug("MYSQL search by milvus id.")
-            return results
+            with self.get_cursor() as cursor:
+                cursor.execute(sql, ids)
+                rows = {int(row[0]): (row[1], row[2]) for row in cursor.fetchall()}
+            LOGGER.debug("MYSQL search by milvus id.", extra={'throttle': 'mysql_search'})
+            return rows
         except Exception as e:
             LOGGER.error(f"MYSQL ERROR: {e} with sql: {sql}")
             sys.exit(1)
 
     def search_by_question(self, question, table_name):
-        sql = "select answer from " + table_name + " where question = '" + question + "';"
+        # Look the question up by the index of its hash, comparing the text guards against collisions
+        self.check_table(table_name)
+        sql = "select answer from " + table_name + " where question_hash = %s and question = %s;"
         try:
-            self.cursor.execute(sql)
-            results = self.cursor.fetchall()
-            LOGGER.debug("MYSQL search by question.")
+            with self.get_cursor() as cursor:
+                cursor.execute(sql, (self.question_hash(question), question))
+                results = cursor.fetchall()
+            LOGGER.debug("MYSQL search by question.", extra={'throttle': 'mysql_search_question'})
             if results:
                 return results[0][0]
             else:
                 return results
         except Exception as e:
-            LOGGER.error(f"MYSQL ERROR: {e} with sql: {sql}".format(e, sql))
+            LOGGER.error(f"MYSQL ERROR: {e} with sql: {sql}")
             sys.exit(1)
 
     def delete_table(self, table_name):
         # Delete mysql table if exists
-        self.test_connection()
         sql = "drop table if exists " + table_name + ";"
         try:
-            self.cursor.execute(sql)
+            with self.get_cursor() as cursor:
+                cursor.execute(sql)
+            self.checked_tables.discard(table_name)
             LOGGER.debug(f"MYSQL delete table:{table_name}")
         except Exception as e:
             LOGGER.error(f"MYSQL ERROR: {e} with sql: {sql}")
@@ -93,11 +193,12 @@ def delete_table(self, table_name):
 
     def delete_all_data(self, table_name):
         # Delete all the data in mysql table
-        self.test_connection()
+        self.check_table(table_name)
         sql = 'delete from ' + table_name + ';'
         try:
-            self.cursor.execute(sql)
-            self.conn.commit()
+            with self.get_cursor() as cursor:
+                cursor.execute(sql)
+                cursor.connection.commit()
             LOGGER.debug(f"MYSQL delete all data in table:{table_name}")
         except Exception as e:
             LOGGER.error(f"MYSQL ERROR: {e} with sql: {sql}")
@@ -105,11 +206,12 @@ def delete_all_data(self, table_name):
 
     def count_table(self, table_name):
         # Get the number of mysql table
-        self.test_connection()
+        self.check_table(table_name)
         sql = "select count(milvus_id) from " + table_name + ";"
         try:
-            self.cursor.execute(sql)
-            results = self.cursor.fetchall()
+            with self.get_cursor() as cursor:
+                cursor.execute(sql)
+                results = cursor.fetchall()
             LOGGER.debug(f"MYSQL count table:{table_name}")
             return results[0][0]
         except Exception as e:
@@ -3,6 +3,7 @@
 from logs import LOGGER
 from milvus_helpers import MilvusHelper
 from mysql_helpers import MySQLHelper
+from search_cache import SEARCH_CACHE
 
 
 def do_drop(table_name: str, milvus_cli: MilvusHelper, mysql_cli: MySQLHelper):
@@ -14,6 +15,7 @@ def do_drop(table_name: str, milvus_cli: MilvusHelper, mysql_cli: MySQLHelper):
             return msg
         status = milvus_cli.delete_collection(table_name)
         mysql_cli.delete_table(table_name)
+        SEARCH_CACHE.invalidate(table_name)
         return status
     except Exception as e:
         LOGGER.error(f" Error with  drop table: {e}")
@@ -1,20 +1,46 @@
+import os
 import sys
+import threading
 import pandas as pd
-from config import DEFAULT_TABLE
+from config import DEFAULT_TABLE, LOAD_CHUNK_SIZE
 from logs import LOGGER
 from milvus_helpers import MilvusHelper
 from mysql_helpers import MySQLHelper
 from encode import SentenceModel
+from search_cache import SEARCH_CACHE
+
+# table name -> progress of its running or last load, served by /qa/progress
+LOAD_PROGRESS = {}
+PROGRESS_LOCK = threading.Lock()
+
+
+def report_progress(table_name, **fields):
+    with PROGRESS_LOCK:
+        LOAD_PROGRESS.setdefault(table_name, {}).update(fields)
+
+
+def get_progress(table_name):
+    with PROGRESS_LOCK:
+        return dict(LOAD_PROGRESS.get(table_name or DEFAULT_TABLE, {}))
+
+
+# Read the csv chunk by chunk, yield the questions and answers of each chunk with the bytes read so far
+def read_chunks(file_dir, chunk_size=LOAD_CHUNK_SIZE):
+    try:
+        with open(file_dir, 'rb') as f:
+            for chunk in pd.read_csv(f, chunksize=chunk_size, usecols=['question', 'answer']):
+                # Empty cells are read as nan and numeric cells as numbers, the VARCHAR fields need strings
+                chunk = chunk.fillna('').astype(str)
+                yield chunk['question'].tolist(), chunk['answer'].tolist(), f.tell()
+    except Exception as e:
+        LOGGER.error(f" Error with reading data from {file_dir}: {e}")
+        sys.exit(1)
 
 
 # Get the vector of question
-def extract_features(file_dir, model):
+def extract_features(question_data, model):
     try:
-        data = pd.read_csv(file_dir)
-        question_data = data['question'].tolist()
-        answer_data = data['answer'].tolist()
-        sentence_embeddings = model.sentence_encode(question_data)
-        return question_data, answer_data, sentence_embeddings
+        return model.sentence_encode(question_data)
     except Exception as e:
         LOGGER.error(f" Error with extracting feature from question {e}")
         sys.exit(1)
@@ -26,15 +52,33 @@ def format_data(ids, question_data, answer_data):
     return data
 
 
-# Import vectors to Milvus and data to Mysql respectively
-def do_load(table_name: str, file_dir: str, model: SentenceModel, milvus_client: MilvusHelper, mysql_cli: MySQLHelper):
+# Import vectors to Milvus and data to Mysql chunk by chunk, so memory stays bounded by chunk_size rows
+def do_load(table_name: str, file_dir: str, model: SentenceModel, milvus_client: MilvusHelper, mysql_cli: MySQLHelper,
+            chunk_size: int = LOAD_CHUNK_SIZE):
     if not table_name:
         table_name = DEFAULT_TABLE
     if not milvus_client.has_collection(table_name):
         milvus_client.create_collection(table_name)
         milvus_client.create_index(table_name)
-    question_data, answer_data, sentence_embeddings = extract_features(file_dir, model)
-    ids = milvus_client.insert(table_name, sentence_embeddings)
     mysql_cli.create_mysql_table(table_name)
-    mysql_cli.load_data_to_mysql(table_name, format_data(ids, question_data, answer_data))
-    return len(ids)
+    total_bytes = os.path.getsize(file_dir)
+    report_progress(table_name, status="running", current=0, bytes_read=0, total_bytes=total_bytes)
+    num = 0
+    try:
+        for question_data, answer_data, bytes_read in read_chunks(file_dir, chunk_size):
+            sentence_embeddings = extract_features(question_data, model)
+            ids = milvus_client.insert(table_name, sentence_embeddings, {"question": question_data, "answer": answer_data})
+            mysql_cli.load_data_to_mysql(table_name, format_data(ids, question_data, answer_data))
+            num += len(ids)
+            report_progress(table_name, current=num, bytes_read=bytes_read)
+            LOGGER.info(f"Loaded {num} questions to table {table_name}, {bytes_read} of {total_bytes} bytes read",
+                        extra={'throttle': 'load_chunk'})
+        # Seal the loaded data once, so that the count is accurate right after the load
+        milvus_client.flush(table_name)
+    except (Exception, SystemExit):
+        report_progress(table_name, status="failed")
+        raise
+    finally:
+        SEARCH_CACHE.invalidate(table_name)
+    report_progress(table_name, status="finished", bytes_read=total_bytes)
+    return num
@@ -1,30 +1,61 @@
 import sys
-from config import TOP_K, DEFAULT_TABLE
+from config import TOP_K, DEFAULT_TABLE, METRIC_TYPE
 from logs import LOGGER
 from milvus_helpers import MilvusHelper
 from mysql_helpers import MySQLHelper
 from encode import SentenceModel
+from search_cache import SEARCH_CACHE
 
 
-def do_search(table_name: str, question: str, model: SentenceModel, milvus_client: MilvusHelper, mysql_cli: MySQLHelper):
+def within_threshold(distance, threshold):
+    # With IP on normalized vectors a larger distance is more similar, with L2 a smaller one
+    if threshold is None:
+        return True
+    return distance >= threshold if METRIC_TYPE == 'IP' else distance <= threshold
+
+
+# Return the page of top_k hits after the first offset hits, without the hits beyond the threshold
+def do_search(table_name: str, question: str, model: SentenceModel, milvus_client: MilvusHelper, mysql_cli: MySQLHelper,
+              top_k: int = TOP_K, offset: int = 0, threshold: float = None):
     try:
         if not table_name:
             table_name = DEFAULT_TABLE
+        # The same question skips the encoding, a paraphrase within the cache threshold skips the search
+        params = (top_k, offset, threshold)
+        generation = SEARCH_CACHE.generation(table_name)
+        cached = SEARCH_CACHE.get(table_name, question, params)
+        if cached is not None:
+            return cached
         feat = model.sentence_encode([question])
-        results = milvus_client.search_vectors(table_name, feat, TOP_K)
-        vids = [str(x.id) for x in results[0]]
-        questions = mysql_cli.search_by_milvus_ids(vids, table_name)
-        distances = [x.distance for x in results[0]]
-        return questions, distances
+        cached = SEARCH_CACHE.get_similar(table_name, feat[0], params)
+        if cached is not None:
+            return cached
+        # The page is selected by Milvus, and only the hits within the threshold are joined with MySQL
+        if 'question' in milvus_client.scalar_fields(table_name):
+            results = milvus_client.search_vectors(table_name, feat, top_k, ['question', 'answer'], offset)
+            hits = [(x.id, x.entity.get('question'), x.entity.get('answer'), x.distance) for x in results[0]
+                    if within_threshold(x.distance, threshold)]
+        else:
+            results = milvus_client.search_vectors(table_name, feat, top_k, offset=offset)
+            results = [x for x in results[0] if within_threshold(x.distance, threshold)]
+            rows = mysql_cli.get_by_milvus_ids([x.id for x in results], table_name)
+            hits = [(x.id, *rows[x.id], x.distance) for x in results if x.id in rows]
+        results = [{"id": str(milvus_id), "question": q, "answer": a, "distance": d} for milvus_id, q, a, d in hits]
+        SEARCH_CACHE.set(table_name, question, feat[0], results, generation, params)
+        return results
     except Exception as e:
         LOGGER.error(f" Error with search : {e}")
         sys.exit(1)
 
 
-def do_get_answer(table_name, question, mysql_cli):
+def do_get_answer(table_name, question, mysql_cli, milvus_id=None):
+    # Get the answer by the milvus id returned by search, or by the text of the question
     try:
         if not table_name:
             table_name = DEFAULT_TABLE
+        if milvus_id is not None:
+            row = mysql_cli.get_by_milvus_ids([milvus_id], table_name).get(int(milvus_id))
+            return row[1] if row else []
         answer = mysql_cli.search_by_question(question, table_name)
         return answer
     except Exception as e:
@@ -0,0 +1,74 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from config import QA_CACHE_SIZE, QA_CACHE_THRESHOLD
+
+
+class SemanticCache:
+    """
+    LRU cache of the results of /qa/search in front of do_search.
+
+    An entry is keyed by table, search params and question text and keeps the normalized
+    embedding of the question. The same text hits without being encoded, a question whose
+    embedding has a cosine similarity of at least `threshold` with a cached question of the
+    table and the same search params reuses its results.
+    A load or a drop of a table removes its entries and bumps its generation, so that the
+    searches which started before are not cached.
+    """
+    def __init__(self, max_size=QA_CACHE_SIZE, threshold=QA_CACHE_THRESHOLD):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def generation(self, table_name):
+        return self.generations.get(table_name, 0)
+
+    def get(self, table_name, question, params=()):
+        # Get the cached results of the same question text and search params
+        key = (table_name, params, question)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def get_similar(self, table_name, feat, params=()):
+        # Get the cached results of the most similar question of the table with the same search params,
+        # if it is within the threshold
+        if self.threshold <= 0:
+            return None
+        with self.lock:
+            keys = [key for key in self.entries if key[:2] == (table_name, params)]
+            if not keys:
+                return None
+            scores = np.stack([self.entries[key][0] for key in keys]) @ feat
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            self.entries.move_to_end(keys[best])
+            return self.entries[keys[best]][1]
+
+    def set(self, table_name, question, feat, results, generation, params=()):
+        # Cache the results unless the table changed since the search started
+        if self.max_size <= 0:
+            return
+        key = (table_name, params, question)
+        with self.lock:
+            if generation != self.generation(table_name):
+                return
+            self.entries[key] = (feat, results)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, table_name):
+        with self.lock:
+            self.generations[table_name] = self.generation(table_name) + 1
+            for key in [key for key in self.entries if key[0] == table_name]:
+                del self.entries[key]
+
+
+SEARCH_CACHE = SemanticCache()
@@ -1,5 +1,5 @@
 from fastapi.testclient import TestClient
-from main import app
+from app import app
 
 client = TestClient(app)
 
@@ -18,6 +18,22 @@ def test_search():
     assert response.json()[0]['status'] == True
 
 
+def test_search_inline_answer():
+    response = client.get("/qa/search?question=What insurance should i buy")
+    assert response.status_code == 200
+    result = response.json()[0]['results'][0]
+    response = client.get(f"/qa/answer?milvus_id={result['id']}")
+    assert response.json()['msg'] == result['answer']
+
+
+def test_search_page():
+    response = client.get("/qa/search?question=What insurance should i buy&top_k=3&offset=2")
+    assert response.status_code == 200
+    assert len(response.json()[0]['results']) == 3
+    response = client.get("/qa/search?question=What insurance should i buy&threshold=1.01")
+    assert response.json()[0]['results'] == []
+
+
 def test_answer():
     response = client.get("/qa/answer?question=Is  Disability  Insurance  Required  By  Law?")
     assert response.status_code == 200
@@ -33,3 +49,10 @@ def test_count():
 def test_drop():
     response = client.post("/qa/drop")
     assert response.status_code == 200
+
+
+def test_progress():
+    response = client.get("/qa/progress")
+    assert response.status_code == 200
+    assert response.json()['status'] == 'finished'
+    assert response.json()['current'] == 99